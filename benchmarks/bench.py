@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Offline benchmarks for the stages of the comics-mailer pipeline. Each stage runs on the recorded ComicList
+# feed in fixtures/, and on generated feeds scaled by the number of entries, the lines per entry and the
+# watchlist size. Results are written as JSON so that runs can be compared across commits, e.g.:
+#
+#   python3 benchmarks/bench.py --output before.json
+#   python3 benchmarks/bench.py --quick
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+import tracemalloc
+from datetime import date, datetime, timedelta
+from argparse import ArgumentParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import feedparser
+import comics_mailer
+
+FIXTURE_FEED = os.path.join(HERE, 'fixtures', 'comiclist.xml')
+
+# Default workload sizes
+DEFAULT_ENTRIES   = [1, 10, 100]
+DEFAULT_LINES     = [300]
+DEFAULT_WATCHLIST = [10, 100, 1000, 10000]
+QUICK_ENTRIES     = [1, 10]
+QUICK_WATCHLIST   = [10, 1000]
+
+# Vocabulary for the generated release lines
+PUBLISHERS = ['DC COMICS', 'MARVEL COMICS', 'IMAGE COMICS', 'DARK HORSE COMICS', 'IDW PUBLISHING', 'BOOM! STUDIOS',
+    'DYNAMITE', 'ONI PRESS', 'Diamond Select Toys', 'Funko', 'Wizkids']
+WORDS      = ['Amazing', 'Uncanny', 'Spider-Man', 'X-Men', 'Batman', 'Saga', 'Hellboy', 'Detective', 'Comics', 'Black',
+    'Hammer', 'Wonder', 'Woman', 'Green', 'Lantern', 'Swamp', 'Thing', 'Spawn', 'Walking', 'Dead', 'Star', 'Wars',
+    'Ultimate', 'Absolute', 'Immortal', 'Thor', 'Fantastic', 'Four', 'Daredevil', 'Nightwing', 'Conan', 'Usagi']
+VARIANTS   = [' (Cover B Variant)', ' (2nd Printing)', ' (Variant Edition)', ' (Cover C 1:25 Variant)']
+
+# Generate the title of a series
+def make_series(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+
+# Generate the release lines of a week
+def make_lines(rng, count, when):
+    lines = []
+    for _ in range(count):
+        title = make_series(rng)
+        if rng.random() < 0.9:
+            title += ' #' + str(rng.randint(1, 900))
+            if rng.random() < 0.3:
+                title += rng.choice(VARIANTS)
+        else:
+            title += ' Vol ' + str(rng.randint(1, 12)) + ' TP'
+        lines.append(','.join([when, rng.choice(PUBLISHERS), title, '$' + str(rng.randint(2, 9)) + '.99']))
+    return lines
+
+# Generate a ComicList-like entry summary, with the release list in its fifth paragraph
+def make_summary(lines):
+    return '<p><img src="logo.gif" alt="ComicList" /></p>\n<p>Here are the new comic books shipping this week.</p>\n' + \
+        '<p>This list is subject to change.</p>\n<p>Download it as a <a href="#">spreadsheet</a> &amp; in CSV:</p>\n' + \
+        '<p>' + '<br />\n'.join(l.replace('&', '&amp;') for l in lines) + '</p>\n<p>Thanks to Diamond.</p>'
+
+# Generate a feed with one entry per week, newest first
+def make_feed(rng, entries, lines):
+    items = []
+    for i in range(entries):
+        week = date(2026, 10, 21) - timedelta(weeks=i)
+        when = '{}/{}/{}'.format(week.month, week.day, week.year)
+        items.append('<item><title>ComicList: New Comic Book Releases List for ' + when + '</title>' +
+            '<link>http://www.comiclist.com/index.php/newreleases/' + week.isoformat() + '</link>' +
+            '<description><![CDATA[' + make_summary(make_lines(rng, lines, when)) + ']]></description></item>')
+    return '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>ComicList</title>' + \
+        ''.join(items) + '</channel></rss>'
+
+# Generate a watchlist, mixing titles that will match with ones that won't. The fuzzy matching stage uses the same
+# entries with a ~ prefix.
+def make_watchlist(rng, size):
+    return [make_series(rng) if rng.random() < 0.5 else 'No Such Series ' + str(i) for i in range(size)]
+
+# Time a function, keeping the best of several runs, then measure its peak memory in a separate run
+def measure(f, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best    = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+# Run every stage on a feed, returning one result per stage
+def bench_feed(name, xml, watchlist_sizes, repeat, rng):
+    results = []
+
+    def record(stage, items, f, **params):
+        seconds, peak = measure(f, repeat)
+        params.update(workload=name)
+        results.append({
+            'stage':      stage,
+            'params':     params,
+            'items':      items,
+            'seconds':    seconds,
+            'throughput': items / seconds if seconds > 0 else None,
+            'peak_bytes': peak,
+        })
+        print('{:<16} {:<45} {:>9} items {:>10.4f}s {:>12.0f}/s {:>10.1f} KiB'.format(stage,
+            ' '.join(k + '=' + str(v) for k, v in sorted(params.items())), items, seconds,
+            results[-1]['throughput'] or 0, peak / 1024), file=sys.stderr)
+
+    feed      = feedparser.parse(xml)
+    summaries = [e.summary for e in feed.entries]
+    lines     = [l for s in summaries for l in comics_mailer.extract_comics(s, comics_mailer.PARSER_STREAM)]
+    records   = comics_mailer.parse_comic_records(lines)
+    source    = comics_mailer.Source('bench', None, comics_mailer.EXTRACTOR_COMICLIST, 0, '', None, None)
+    index     = comics_mailer.EntryIndex.build(source, feed.entries)
+    since     = sorted(comics_mailer.get_entry_date(e) for e in feed.entries)[len(feed.entries) // 2]
+
+    record('feedparse',      len(feed.entries), lambda: feedparser.parse(xml))
+    record('entry-date',     len(feed.entries), lambda: [comics_mailer.get_entry_date(e) for e in feed.entries])
+    record('entry-index',    len(feed.entries), lambda: comics_mailer.EntryIndex.build(source, feed.entries))
+    record('entry-since',    len(feed.entries), lambda: list(comics_mailer.get_new_entries(source, feed, since, index)))
+    record('extract-stream', len(summaries), lambda: [comics_mailer.extract_comics(s, comics_mailer.PARSER_STREAM) for s in summaries])
+    record('extract-bs4',    len(summaries), lambda: [comics_mailer.extract_comics(s, comics_mailer.PARSER_BS4) for s in summaries])
+    record('records',        len(lines), lambda: comics_mailer.parse_comic_records(lines))
+
+    for size in watchlist_sizes:
+        watchlist = make_watchlist(rng, size)
+        record('matcher-build', size, lambda: comics_mailer.WatchlistMatcher(watchlist), watchlist=size)
+        matcher = comics_mailer.WatchlistMatcher(watchlist)
+        record('match', len(records), lambda: list(comics_mailer.match_comics(records, matcher)), watchlist=size)
+        fuzzy = comics_mailer.WatchlistMatcher(['~' + w for w in watchlist])
+        record('match-fuzzy', len(records), lambda: list(comics_mailer.match_comics(records, fuzzy)), watchlist=size)
+
+    return results
+
+# Identify the code being benchmarked
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_cli_args():
+    parser = ArgumentParser(description="Benchmark the comics-mailer pipeline stages offline.")
+
+    parser.add_argument('--entries', type=int, nargs='+', default=DEFAULT_ENTRIES, help='Numbers of feed entries to generate.')
+    parser.add_argument('--lines', type=int, nargs='+', default=DEFAULT_LINES, help='Numbers of release lines per generated entry.')
+    parser.add_argument('--watchlist', type=int, nargs='+', default=DEFAULT_WATCHLIST, help='Watchlist sizes to match against.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each stage; the fastest one is reported.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated workloads.')
+    parser.add_argument('--quick', action='store_true', help='Run a smaller set of workloads.')
+    parser.add_argument('--output', '-o', metavar='FILE', help='Write the JSON results to FILE instead of stdout.')
+
+    return parser.parse_args()
+
+def main():
+    cli_args = parse_cli_args()
+    if cli_args.quick:
+        cli_args.entries, cli_args.watchlist, cli_args.repeat = QUICK_ENTRIES, QUICK_WATCHLIST, 1
+
+    rng     = random.Random(cli_args.seed)
+    results = []
+
+    with open(FIXTURE_FEED, 'r') as f:
+        results += bench_feed('fixture', f.read(), cli_args.watchlist, cli_args.repeat, rng)
+
+    for entries in cli_args.entries:
+        for lines in cli_args.lines:
+            xml = make_feed(rng, entries, lines)
+            for r in bench_feed('generated', xml, cli_args.watchlist, cli_args.repeat, rng):
+                r['params'].update(entries=entries, lines=lines)
+                results.append(r)
+
+    report = json.dumps({
+        'commit':  get_commit(),
+        'date':    datetime.now().isoformat(),
+        'python':  platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }, indent=2)
+
+    if cli_args.output:
+        with open(cli_args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
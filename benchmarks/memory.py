@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Memory check for the comics-mailer pipeline. Streams generated feeds of a growing number of entries from the
+# parsed entries to the matches, measuring the peak memory of each run with tracemalloc, and fails if it grows
+# with the number of entries rather than staying flat, e.g.:
+#
+#   python3 benchmarks/memory.py
+#   python3 benchmarks/memory.py --entries 50 500 --tolerance 1.2
+#
+# The feed itself is parsed by feedparser beforehand and is not counted: feedparser always reads a whole document.
+
+import os
+import sys
+import json
+import random
+import tempfile
+import tracemalloc
+from configparser import ConfigParser
+from argparse import ArgumentParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import feedparser
+import comics_mailer
+from bench import make_feed
+
+DEFAULT_ENTRIES = [20, 80, 320]
+
+# Stream a feed's entries through extraction, record parsing and matching, returning the matches and the peak
+# memory used in bytes
+def measure_pipeline(feed, watchlist, data_folder):
+    source   = comics_mailer.Source('bench', None, comics_mailer.EXTRACTOR_COMICLIST, 0, '', None, None)
+    settings = comics_mailer.Settings(ConfigParser())
+    matcher  = comics_mailer.WatchlistMatcher(watchlist)
+
+    # Start with an empty parse cache, so that every entry is parsed and the cache grows up to its limit
+    comics_mailer.DATA_FOLDER           = data_folder
+    comics_mailer.DATA_FILE_PARSE_CACHE = os.path.join(data_folder, 'parse_cache.json')
+    if os.path.isfile(comics_mailer.DATA_FILE_PARSE_CACHE):
+        os.remove(comics_mailer.DATA_FILE_PARSE_CACHE)
+
+    tracemalloc.start()
+    try:
+        comics  = comics_mailer.parse_comic_list([(source, iter(feed.entries))], settings)
+        matched = list(comics_mailer.filter_notified(comics_mailer.match_comics(comics, matcher), 0))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return matched, peak
+
+def parse_cli_args():
+    parser = ArgumentParser(description="Check that the memory used by the comics-mailer pipeline does not grow with the feed.")
+
+    parser.add_argument('--entries', type=int, nargs='+', default=DEFAULT_ENTRIES, help='Numbers of feed entries to generate.')
+    parser.add_argument('--lines', type=int, default=100, help='Release lines per generated entry.')
+    parser.add_argument('--cache-size', type=int, default=32 * 1024, help='Parse cache limit to use, in characters.')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='Largest allowed ratio between the peaks of the largest and smallest feeds.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated feeds.')
+    parser.add_argument('--output', '-o', metavar='FILE', help='Write the JSON results to FILE.')
+
+    return parser.parse_args()
+
+def main():
+    cli_args = parse_cli_args()
+    rng      = random.Random(cli_args.seed)
+    results  = []
+
+    # Only the matches are kept for the mail, so watch a few comics to keep them small next to the feed
+    watchlist = ['Hellboy #1,', 'Saga #2', 'No Such Series']
+    comics_mailer.PARSE_CACHE_MAX_SIZE = cli_args.cache_size
+
+    with tempfile.TemporaryDirectory() as data_folder:
+        for entries in sorted(cli_args.entries):
+            feed          = feedparser.parse(make_feed(rng, entries, cli_args.lines))
+            matched, peak = measure_pipeline(feed, watchlist, data_folder)
+
+            results.append({'entries': entries, 'lines': cli_args.lines, 'matches': len(matched), 'peak_bytes': peak})
+            print('{:>6} entries {:>8} lines {:>4} matches {:>10.1f} KiB peak'.format(entries, entries * cli_args.lines,
+                len(matched), peak / 1024), file=sys.stderr)
+
+    if cli_args.output:
+        with open(cli_args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2) + '\n')
+
+    ratio = results[-1]['peak_bytes'] / results[0]['peak_bytes']
+    if ratio > cli_args.tolerance:
+        print('FAIL peak memory grew {:.2f} times from {} to {} entries'.format(ratio, results[0]['entries'],
+            results[-1]['entries']), file=sys.stderr)
+        sys.exit(1)
+
+    print('Peak memory stayed within {:.2f} times from {} to {} entries'.format(ratio, results[0]['entries'],
+        results[-1]['entries']), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Start-up check for comics-mailer. Runs the script in fresh interpreters with -X importtime (Python 3.7+),
+# reports how long its imports and --help take, and fails if a heavy dependency is imported at start-up rather
+# than by the stage that needs it, e.g.:
+#
+#   python3 benchmarks/startup.py
+#   python3 benchmarks/startup.py --max-import-ms 100
+
+import os
+import sys
+import json
+import time
+import subprocess
+from argparse import ArgumentParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must only be imported once a run needs them
+HEAVY_MODULES = ['requests', 'feedparser', 'bs4', 'urllib3', 'concurrent.futures', 'cProfile']
+
+# What to start: a bare import of the module, and the command line help
+COMMANDS = [
+    ('import', ['-c', 'import comics_mailer']),
+    ('help',   ['-c', 'import sys, comics_mailer; sys.argv = ["comics_mailer.py", "--help"]; comics_mailer.main()']),
+]
+
+# Run a command with -X importtime, returning its wall time and the imported modules with their cumulative
+# import times in microseconds
+def run_importtime(args):
+    start = time.perf_counter()
+    proc  = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=os.path.dirname(HERE),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    wall  = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(' '.join(args) + ' failed:\n' + proc.stderr)
+
+    # Lines look like "import time:   self [us] | cumulative | imported package", nested by indentation
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+
+    return wall, modules
+
+def parse_cli_args():
+    parser = ArgumentParser(description="Check how quickly comics-mailer starts and that it defers its heavy imports.")
+
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each command; the fastest one is reported.')
+    parser.add_argument('--max-import-ms', type=float, help='Also fail if importing comics_mailer takes longer than this.')
+    parser.add_argument('--output', '-o', metavar='FILE', help='Write the JSON results to FILE.')
+
+    return parser.parse_args()
+
+def main():
+    cli_args = parse_cli_args()
+    results  = []
+    failures = []
+
+    for name, args in COMMANDS:
+        runs    = [run_importtime(args) for _ in range(cli_args.repeat)]
+        wall    = min(w for w, _ in runs)
+        modules = min((m for _, m in runs), key=lambda m: m.get('comics_mailer', 0))
+        heavy   = [m for m in HEAVY_MODULES if m in modules]
+        imports = modules.get('comics_mailer', 0) / 1000
+
+        results.append({'command': name, 'seconds': wall, 'import_ms': imports, 'modules': len(modules), 'heavy': heavy})
+        print('{:<8} {:>8.1f} ms wall {:>8.1f} ms importing comics_mailer {:>5} modules'.format(name, wall * 1000,
+            imports, len(modules)), file=sys.stderr)
+
+        if heavy:
+            failures.append(name + ': imported ' + ', '.join(heavy) + ' at start-up')
+        if cli_args.max_import_ms is not None and imports > cli_args.max_import_ms:
+            failures.append(name + ': importing comics_mailer took {:.1f} ms'.format(imports))
+
+    if cli_args.output:
+        with open(cli_args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2) + '\n')
+
+    for failure in failures:
+        print('FAIL', failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
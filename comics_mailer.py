@@ -5,16 +5,31 @@ import sys
 import os
 import os.path
 import shutil
-import requests
 import itertools
 import csv
+import sqlite3
+import json
+import time
+import math
+import hashlib
+import bisect
+import random
+import signal
+import threading
+import traceback
 from pathlib import Path
+from collections import namedtuple, OrderedDict
+from functools import partial, wraps
+from types import GeneratorType
+from contextlib import contextmanager
 from configparser import ConfigParser
-from datetime import date, datetime
-from argparse import ArgumentParser
+from datetime import date, datetime, timedelta
+from argparse import ArgumentParser, ArgumentTypeError
+from html.parser import HTMLParser
+from email.utils import parseaddr
 
-import feedparser
-from bs4 import BeautifulSoup as soup
+# requests, feedparser and BeautifulSoup are slow to import, so they are only imported by the functions that use
+# them: the setup, the history and --help start at once, and a run that finds nothing new never parses HTML
 
 # Config files
 CONFIG_FOLDER         = Path.home() / '.config/comics-mailer'
@@ -26,6 +41,21 @@ CONFIG_FOLDER         = str(CONFIG_FOLDER) # os.path methods require a string
 DATA_FOLDER           = Path.home() / '.local/share/comics-mailer'
 DATA_FILE_LAST_UPDATE = str(DATA_FOLDER / 'last_update')
 DATA_FILE_MATCH_LOG   = str(DATA_FOLDER / 'match.log')
+DATA_FOLDER_TENANTS   = str(DATA_FOLDER / 'tenants')
+DATA_FILE_FEED_CACHE  = str(DATA_FOLDER / 'feed.xml')  # The last good copy of the feed
+DATA_FILE_FEED_META   = str(DATA_FOLDER / 'feed.json') # The cached feed's HTTP validators and timestamps
+DATA_FOLDER_SOURCES   = str(DATA_FOLDER / 'sources')   # The same, for the other release sources
+DATA_FILE_PARSE_CACHE = str(DATA_FOLDER / 'parse_cache.json') # The comics already extracted from each feed entry
+DATA_FILE_HISTORY     = str(DATA_FOLDER / 'history.db') # The SQLite history of all matches
+DATA_FOLDER_OUTBOX    = str(DATA_FOLDER / 'outbox')     # Emails waiting to be delivered
+DATA_FOLDER_FAILED    = str(DATA_FOLDER / 'outbox' / 'failed') # Emails that could not be delivered after many tries
+DATA_FILE_OUTBOX_LOCK = str(DATA_FOLDER / 'outbox' / '.lock') # Locked by the process delivering the emails
+DATA_FILE_RUN_REPORT  = str(DATA_FOLDER / 'run_report.json')    # Timings and counters of the last run
+DATA_FILE_METRICS     = str(DATA_FOLDER / 'comics_mailer.prom') # The same, for the Prometheus textfile collector
+DATA_FILE_PROFILE     = str(DATA_FOLDER / 'profile.pstats')     # cProfile stats, when running with --profile
+DATA_FOLDER_WATCHLISTS = str(DATA_FOLDER / 'watchlists')        # The compiled watchlists, one per watchlist file
+DATA_FOLDER_ARCHIVE   = str(DATA_FOLDER / 'archive')    # Compressed copies of every feed fetched, for --replay
+DATA_FILE_RUN_LOCK    = str(DATA_FOLDER / 'run.lock')   # Locked by the check that is running
 DATA_FOLDER           = str(DATA_FOLDER) # os.path methods require a string
 
 # Config keys
@@ -38,8 +68,36 @@ CONFIG_KEY_MAILGUN_TO     = 'to'      # The recipient, e.g. as "Name <email@tld.
 CONFIG_SECTION_BEHAVIOUR               = 'behaviour'
 CONFIG_KEY_BEHAVIOUR_MAIL_ON_ERROR     = 'mail_on_error' # Whether to send an email when an error occurs, detailing the error
 CONFIG_DEFAULT_BEHAVIOUR_MAIL_ON_ERROR = True
-CONFIG_KEY_BEHAVIOUR_LOG_FILE          = 'log_file' # The log file in which matches are saved
+CONFIG_KEY_BEHAVIOUR_LOG_FILE          = 'log_file' # The CSV log file, imported into the match history and optionally kept up to date
 CONFIG_DEFAULT_BEHAVIOUR_LOG_FILE      = DATA_FILE_MATCH_LOG
+CONFIG_KEY_BEHAVIOUR_LOG_CSV           = 'log_csv' # Whether to keep appending matches to the CSV log file as well as to the history
+CONFIG_DEFAULT_BEHAVIOUR_LOG_CSV       = True
+CONFIG_KEY_BEHAVIOUR_NOTIFIED_EXPIRY   = 'notified_expiry' # For how many days an issue you were told about is not mailed again (0 to disable)
+CONFIG_DEFAULT_BEHAVIOUR_NOTIFIED_EXPIRY = 365
+CONFIG_KEY_BEHAVIOUR_WATCHLIST         = 'watchlist' # The watchlist file, used by tenant configs only
+CONFIG_KEY_BEHAVIOUR_FEED_MAX_AGE      = 'feed_max_age' # How old (in days) the cached feed may be when used because the live one is unavailable
+CONFIG_DEFAULT_BEHAVIOUR_FEED_MAX_AGE  = 7
+CONFIG_KEY_BEHAVIOUR_PARSER            = 'parser' # How to extract the comics from the feed: 'stream' (fast) or 'bs4' (BeautifulSoup)
+CONFIG_DEFAULT_BEHAVIOUR_PARSER        = 'stream'
+CONFIG_KEY_BEHAVIOUR_JOBS              = 'jobs' # How many processes to use when parsing many feed entries
+CONFIG_DEFAULT_BEHAVIOUR_JOBS          = 1
+CONFIG_KEY_BEHAVIOUR_LOCK              = 'lock' # What to do when another check is running: 'skip' this one, or 'wait' for the other one
+CONFIG_DEFAULT_BEHAVIOUR_LOCK          = 'skip'
+CONFIG_KEY_BEHAVIOUR_LOCK_TIMEOUT      = 'lock_timeout' # With 'wait', how long to wait before skipping, in seconds
+CONFIG_DEFAULT_BEHAVIOUR_LOCK_TIMEOUT  = 600
+
+# Release sources besides ComicList, each in a [source:<name>] section. A [source:comiclist] section changes
+# the ComicList feed, or disables it.
+CONFIG_SECTION_SOURCE       = 'source:'
+CONFIG_KEY_SOURCE_URL       = 'url'       # The URL of the source's feed
+CONFIG_KEY_SOURCE_EXTRACTOR = 'extractor' # How to read the comics from the feed: 'comiclist' or 'titles'
+CONFIG_KEY_SOURCE_TIMEOUT   = 'timeout'   # How long to wait for the feed, in seconds
+CONFIG_KEY_SOURCE_PUBLISHER = 'publisher' # With the 'titles' extractor, the publisher to list the comics under
+CONFIG_KEY_SOURCE_ENABLED   = 'enabled'   # Whether to check the source
+SOURCE_COMICLIST            = 'comiclist'
+
+# Tenant configs live in their own folder, one <name>.cfg file per tenant
+CONFIG_EXT_TENANT = '.cfg'
 
 # Email text
 MAILGUN_SUBJECT_UPDATE = '[comics-mailer] New watched comics available!'
@@ -65,8 +123,113 @@ With great regret,
 
 Comics Mailer'''
 
+# Mailgun API
+MAILGUN_API_URL    = 'https://api.mailgun.net/v3/'
+MAILGUN_TIMEOUT    = (10, 30) # Connect and read timeouts, in seconds
+MAILGUN_RETRIES    = 4        # Retries after a connection error, 429 or 5xx response
+MAILGUN_BACKOFF    = 2        # Seconds to wait before the first retry, doubled after each one
+MAILGUN_MAX_WAIT   = 60       # Longest wait between retries, in seconds
+MAILGUN_BATCH_SIZE = 1000     # Mailgun's limit on recipients per batch message
+
+# Outbox
+OUTBOX_SEND_BUDGET  = 60    # Longest time a run spends delivering queued emails, in seconds
+OUTBOX_ERROR_BUDGET = 15    # Same, when delivering an error report on the way out
+OUTBOX_MAX_ATTEMPTS = 20    # Runs that try to deliver an email before it is moved to the failed folder
+OUTBOX_MAX_DELAY    = 6 * 60 * 60 # Longest wait between delivery attempts, in seconds
+
+# Run lock policies
+LOCK_SKIP       = 'skip'
+LOCK_WAIT       = 'wait'
+LOCK_POLL_DELAY = 0.5 # Seconds between attempts to take a lock while waiting for it
+
+# Daemon mode
+DAEMON_DEFAULT_CRON   = '0 18 * * 3' # Every Wednesday at 6 PM, as in the Docker image
+DAEMON_POLL_DELAY     = 15 * 60      # Seconds before checking again when the new list isn't out yet, doubled each time
+DAEMON_POLL_MAX_DELAY = 2 * 60 * 60  # Longest delay between such checks, in seconds
+DAEMON_POLL_WINDOW    = 24 * 60 * 60 # How long after the scheduled time to keep checking, in seconds
+
 # ComicsList
-FEED_URL = 'http://feeds.feedburner.com/ncrl'
+FEED_URL     = 'http://feeds.feedburner.com/ncrl'
+FEED_TIMEOUT = 30 # seconds
+FEED_REQUEST_SHARE = 0.5 # The share of a source's timeout allowed for connecting to it and for each read of its feed
+
+# The comics are listed in the fifth paragraph of each entry
+FEED_COMICS_PARAGRAPH = 4
+
+# Parsers that can extract the comics from an entry
+PARSER_STREAM = 'stream'
+PARSER_BS4    = 'bs4'
+
+# Extractors that can read the comics from a source's entries
+EXTRACTOR_COMICLIST = 'comiclist' # A weekly entry listing the releases in its fifth paragraph
+EXTRACTOR_TITLES    = 'titles'    # An entry per release, titled after the comic and dated when it was published
+
+# The title of a comic up to its issue number, without variant cover or printing details
+COMIC_TITLE_ONLY = re.compile(r'[^#]+#[\d]+')
+
+# The release date in a ComicList entry's title, as m/d/yyyy
+ENTRY_DATE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
+
+# Watchlist entries starting with ~ are matched fuzzily: a line matches when at least the threshold share of the
+# entry's character trigrams are found in it, ignoring case, spaces and punctuation. The threshold can be given
+# for each entry, e.g. "~0.7:Spiderman".
+FUZZY_ENTRY     = re.compile(r'~\s*(?:(1(?:\.0*)?|0?\.\d+)\s*:)?\s*(.*)')
+FUZZY_THRESHOLD = 0.8
+
+# The first line of a compiled watchlist file. Change the version whenever WatchlistMatcher or the way watchlists
+# are read changes, so that older files are compiled again.
+COMPILED_WATCHLIST_HEADER = b'comics-mailer compiled watchlist 3\n'
+
+# Archived feeds, named after the day they were fetched and the hash of their contents
+ARCHIVE_EXT     = '.xml.gz'
+ARCHIVE_INDEX   = 'index.json' # The entry index of each archived feed of a source, by file name
+ARCHIVE_MAX_AGE = 2 * 365 # Days an archived feed is kept for
+
+# Replay reports
+REPLAY_NEAR_MISS     = 0.2 # How far below an entry's threshold (1 for exact entries) a comic's score is still a near miss
+REPLAY_MAX_NEAR_MISS = 5   # Near misses shown for each watchlist entry
+
+# The match history schema. Matches are recorded per tenant, with '' for the main user.
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS matches (
+    id         INTEGER PRIMARY KEY,
+    tenant     TEXT NOT NULL DEFAULT '',
+    title      TEXT NOT NULL,
+    series     TEXT,
+    issue      INTEGER,
+    match_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_title ON matches (title);
+CREATE INDEX IF NOT EXISTS matches_issue ON matches (series, issue);
+CREATE INDEX IF NOT EXISTS matches_date  ON matches (match_date);
+
+CREATE TABLE IF NOT EXISTS imports (
+    path     TEXT PRIMARY KEY,
+    imported TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS notified (
+    tenant        TEXT NOT NULL,
+    key           TEXT NOT NULL,
+    notified_date TEXT NOT NULL,
+    PRIMARY KEY (tenant, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS notified_date ON notified (notified_date);
+'''
+
+# SQLite limits the number of parameters in a query, so look up notified keys in batches
+NOTIFIED_BATCH_SIZE = 500
+
+# Parsing is only spread across processes when at least this many entries need it, so that weekly runs
+# don't pay for starting a pool
+PARALLEL_MIN_ENTRIES = 8
+
+# Once the cached comic lines grow past this size (in characters), the least recently used entries are dropped
+PARSE_CACHE_MAX_SIZE = 8 * 1024 * 1024
+
+# When parsing across processes, entries are parsed this many at a time, so that few are held in memory while
+# still giving the pool enough work to share out
+PARSE_BATCH_SIZE = 256
 
 DEBUG_NOMAIL      = 'nomail'
 DEBUG_PARAMS      = 'params'
@@ -83,82 +246,494 @@ ERR_NO_FEED        = -1
 ERR_INVALID_PARAMS = -2
 ERR_NO_CONFIG      = -3
 ERR_NO_WATCHLIST   = -4
+ERR_MAIL_FAILED    = -5
 
 # Error code messages
-ERR_MSG_NO_FEED   = 'Could not retrieve the comics feed from ComicList.com. Double check your URL and make sure that the site is still up.'
+ERR_MSG_NO_FEED   = 'Could not retrieve the comics feed from ComicList.com or any other source. Double check your URLs and make sure that the sites are still up.'
 ERR_MSG_NO_CONFIG = "No configuration file found at at " + CONFIG_FILE_PARAMS + ". Please see the README for details on creating one."
 ERR_MSG_GENERIC   = "You'd have to check the code to figure out what this error means (they're all labeled towards the top)."
 
-# Global behaviour settings
-behaviour_mail_on_error = CONFIG_DEFAULT_BEHAVIOUR_MAIL_ON_ERROR
-
-# Print an error message and exit
-def err_exit(msg, code=1):
-    print(msg, file=sys.stderr)
-
-    if behaviour_mail_on_error and code != ERR_NO_CONFIG:
-        send_mail_error(code, msg)
+# Kept between the checks of a daemon, so that they can reuse connections and skip unchanged files
+http_sessions    = {} # Source name to requests session
+watchlist_cache  = {} # Watchlist path to (mtime, matcher)
+
+# Wall time and counters of each stage of a run, exported as a JSON report and Prometheus metrics
+class RunMetrics:
+
+    def __init__(self):
+        self.started   = time.time()
+        self.stages    = OrderedDict() # Stage name to [seconds, calls]
+        self.counters  = OrderedDict()
+        self.exit_code = 0
+        self.nested    = [] # The time spent in the stages running inside each of the stages currently timed
+
+    # Time a stage, adding to its total if it runs more than once. Stages that run inside it, e.g. one pulling
+    # items from another in the pipeline, are only counted towards their own time.
+    @contextmanager
+    def stage(self, name, call=True):
+        start = time.perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed    = time.perf_counter() - start
+            totals     = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += elapsed - self.nested.pop()
+            totals[1] += call
+            if self.nested:
+                self.nested[-1] += elapsed
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        return OrderedDict([
+            ('started',   datetime.fromtimestamp(self.started).isoformat()),
+            ('seconds',   time.time() - self.started),
+            ('exit_code', self.exit_code),
+            ('stages',    OrderedDict((name, {'seconds': t, 'calls': n}) for name, (t, n) in self.stages.items())),
+            ('counters',  self.counters),
+        ])
+
+    # Render the report in the Prometheus text exposition format
+    def prometheus(self):
+        lines = [
+            '# HELP comics_mailer_last_run_timestamp_seconds When the last run started.',
+            '# TYPE comics_mailer_last_run_timestamp_seconds gauge',
+            'comics_mailer_last_run_timestamp_seconds ' + str(self.started),
+            '# HELP comics_mailer_last_run_duration_seconds How long the last run took.',
+            '# TYPE comics_mailer_last_run_duration_seconds gauge',
+            'comics_mailer_last_run_duration_seconds ' + str(time.time() - self.started),
+            '# HELP comics_mailer_last_run_exit_code The exit code of the last run.',
+            '# TYPE comics_mailer_last_run_exit_code gauge',
+            'comics_mailer_last_run_exit_code ' + str(self.exit_code),
+            '# HELP comics_mailer_stage_seconds Wall time spent in each stage of the last run.',
+            '# TYPE comics_mailer_stage_seconds gauge',
+        ]
+        lines += ['comics_mailer_stage_seconds{stage="' + name + '"} ' + str(t) for name, (t, _) in self.stages.items()]
+        lines += ['# HELP comics_mailer_count Items handled by the last run.', '# TYPE comics_mailer_count gauge']
+        lines += ['comics_mailer_count{item="' + name + '"} ' + str(n) for name, n in self.counters.items()]
+
+        return '\n'.join(lines) + '\n'
+
+    # Write the JSON report and the Prometheus metrics, replacing the files at once so that readers never
+    # see them half-written
+    def save(self):
+        try:
+            if not os.path.isdir(DATA_FOLDER):
+                os.makedirs(DATA_FOLDER)
+            for path, text in [(DATA_FILE_RUN_REPORT, json.dumps(self.report(), indent=2)), (DATA_FILE_METRICS, self.prometheus())]:
+                with atomic_write(path) as f:
+                    f.write(text)
+        except (OSError, IOError) as e:
+            print("Failed to save the run report in", DATA_FOLDER + ':', e, file=sys.stderr)
+
+metrics = RunMetrics()
+
+# Decorator timing every call of a function as the given stage of the run. For a generator, the time spent
+# producing each of its items is counted, as they are pulled through the pipeline.
+def timed(stage):
+    def decorate(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(stage):
+                result = f(*args, **kwargs)
+            return timed_items(stage, result) if isinstance(result, GeneratorType) else result
+        return wrapper
+    return decorate
+
+# Pass the items of a generator through, timing the production of each one as part of the given stage
+def timed_items(stage, items):
+    while True:
+        with metrics.stage(stage, call=False):
+            item = next(items, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+# Pass items through, counting them under the given name
+def counted(items, name):
+    for item in items:
+        metrics.count(name)
+        yield item
+
+# Split items into lists of up to size items
+def batched(items, size):
+    items = iter(items)
+    batch = list(itertools.islice(items, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(items, size))
+
+# Write a file through a temporary file renamed over it once it is complete, so that it is never read half-written.
+# The temporary file is named after the process and thread, so that concurrent writers don't share it. With fsync,
+# the contents are flushed to disk before the rename, so that the file also survives a crash.
+@contextmanager
+def atomic_write(path, mode='w', fsync=False):
+    tmp = path + '.' + str(os.getpid()) + '-' + str(threading.get_ident()) + '.tmp'
+    try:
+        with open(tmp, mode) as f:
+            if os.path.isfile(path):
+                shutil.copymode(path, tmp)
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+# Lock an open file until it is closed, waiting while another process holds it. Without fcntl, e.g. on Windows,
+# nothing is locked.
+def lock_file(f):
+    try:
+        import fcntl
+    except ImportError:
+        return
 
-    sys.exit(code)
+    fcntl.flock(f, fcntl.LOCK_EX)
 
-# Read the required mailgun parameters from the config file
-def read_mailgun_params():
-    if not os.path.isfile(CONFIG_FILE_PARAMS):
-        err_exit(ERR_MSG_NO_CONFIG, ERR_NO_CONFIG)
+# Hold a lock file for the duration of a block, yielding whether it was taken. If another process holds it, give up
+# after waiting for up to timeout seconds. The lock file holds the pid of the process holding it.
+@contextmanager
+def file_lock(path, timeout=0):
+    try:
+        import fcntl
+    except ImportError:
+        yield True
+        return
 
-    config = ConfigParser()
-    config.read(CONFIG_FILE_PARAMS)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
 
-    for s in [CONFIG_SECTION_MAILGUN]:
-        if s not in config:
-            err_exit("Invailid Mailgun configuration. Please check the config file at " + \
-                CONFIG_FILE_PARAMS + " and see the README for details.", ERR_INVALID_PARAMS)
+    # Open without truncating, as another process may be holding the lock
+    with open(path, 'a+') as f:
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.time() >= deadline:
+                    yield False
+                    return
+                time.sleep(max(0, min(LOCK_POLL_DELAY, deadline - time.time())))
+
+        try:
+            f.truncate(0)
+            f.write(str(os.getpid()))
+            f.flush()
+            yield True
+        finally:
+            f.truncate(0)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# Hold the run lock for the duration of a check, so that overlapping runs, e.g. a manual one during the cron window,
+# don't fetch, parse and mail the same comics. Yields whether the check should go ahead: when another check holds
+# the lock, this one is skipped straight away or, with the wait policy, once it has waited for too long.
+@contextmanager
+def run_lock(settings):
+    timeout = settings.lock_timeout if settings.lock == LOCK_WAIT else 0
+    with file_lock(DATA_FILE_RUN_LOCK, timeout) as locked:
+        if not locked:
+            try:
+                with open(DATA_FILE_RUN_LOCK, 'r') as f:
+                    holder = f.read().strip()
+            except (OSError, IOError):
+                holder = ''
+            print("Another check" + (" (pid " + holder + ")" if holder else '') + " is running, skipping this one.", file=sys.stderr)
+        yield locked
 
-    for k in [CONFIG_KEY_MAILGUN_KEY, CONFIG_KEY_MAILGUN_DOMAIN, CONFIG_KEY_MAILGUN_FROM, CONFIG_KEY_MAILGUN_TO]:
-        if k not in config[CONFIG_SECTION_MAILGUN]:
-            err_exit("Invailid Mailgun configuration. Please check the config file at " + \
-                CONFIG_FILE_PARAMS + " and see the README for details.", ERR_INVALID_PARAMS)
+# Raised by err_exit(), so that whoever runs the check can report the error with its settings
+class CheckError(SystemExit):
 
-    return config[CONFIG_SECTION_MAILGUN][CONFIG_KEY_MAILGUN_KEY], \
-        config[CONFIG_SECTION_MAILGUN][CONFIG_KEY_MAILGUN_DOMAIN], \
-        config[CONFIG_SECTION_MAILGUN][CONFIG_KEY_MAILGUN_FROM],   \
-        config[CONFIG_SECTION_MAILGUN][CONFIG_KEY_MAILGUN_TO]
+    def __init__(self, code, msg):
+        super().__init__(code)
+        self.msg = msg
 
-# Read custom behaviour parameters from the config file
-def read_behaviour_params():
+# Print an error message and exit
+def err_exit(msg, code=1):
+    print(msg, file=sys.stderr)
+    raise CheckError(code, msg)
+
+# The settings of a run, read from the config file once
+class Settings:
+
+    def __init__(self, config, mtime=None):
+        mailgun   = config[CONFIG_SECTION_MAILGUN] if CONFIG_SECTION_MAILGUN in config else {}
+        behaviour = config[CONFIG_SECTION_BEHAVIOUR] if CONFIG_SECTION_BEHAVIOUR in config else config[config.default_section]
+
+        self.mtime          = mtime
+        self.mailgun_key    = mailgun.get(CONFIG_KEY_MAILGUN_KEY)
+        self.mailgun_domain = mailgun.get(CONFIG_KEY_MAILGUN_DOMAIN)
+        self.mailgun_from   = mailgun.get(CONFIG_KEY_MAILGUN_FROM)
+        self.mailgun_to     = mailgun.get(CONFIG_KEY_MAILGUN_TO)
+
+        self.mail_on_error   = behaviour.getboolean(CONFIG_KEY_BEHAVIOUR_MAIL_ON_ERROR, CONFIG_DEFAULT_BEHAVIOUR_MAIL_ON_ERROR)
+        self.log_file        = behaviour.get(CONFIG_KEY_BEHAVIOUR_LOG_FILE, CONFIG_DEFAULT_BEHAVIOUR_LOG_FILE)
+        self.feed_max_age    = behaviour.getfloat(CONFIG_KEY_BEHAVIOUR_FEED_MAX_AGE, CONFIG_DEFAULT_BEHAVIOUR_FEED_MAX_AGE)
+        self.parser          = behaviour.get(CONFIG_KEY_BEHAVIOUR_PARSER, CONFIG_DEFAULT_BEHAVIOUR_PARSER)
+        self.jobs            = behaviour.getint(CONFIG_KEY_BEHAVIOUR_JOBS, CONFIG_DEFAULT_BEHAVIOUR_JOBS)
+        self.log_csv         = behaviour.getboolean(CONFIG_KEY_BEHAVIOUR_LOG_CSV, CONFIG_DEFAULT_BEHAVIOUR_LOG_CSV)
+        self.notified_expiry = behaviour.getint(CONFIG_KEY_BEHAVIOUR_NOTIFIED_EXPIRY, CONFIG_DEFAULT_BEHAVIOUR_NOTIFIED_EXPIRY)
+        self.lock            = behaviour.get(CONFIG_KEY_BEHAVIOUR_LOCK, CONFIG_DEFAULT_BEHAVIOUR_LOCK)
+        self.lock_timeout    = behaviour.getfloat(CONFIG_KEY_BEHAVIOUR_LOCK_TIMEOUT, CONFIG_DEFAULT_BEHAVIOUR_LOCK_TIMEOUT)
+        self.sources         = read_sources(config)
+
+        self.client = None
+
+    # Get the Mailgun client, started when it is first needed and shared for as long as these settings are used
+    def mail_client(self):
+        if self.client is None:
+            self.client = MailgunClient(self.mailgun_key, self.mailgun_domain, self.mailgun_from, MAILGUN_API_URL,
+                MAILGUN_RETRIES, MAILGUN_BACKOFF)
+        return self.client
+
+# Read the config file
+def read_config():
     if not os.path.isfile(CONFIG_FILE_PARAMS):
         err_exit(ERR_MSG_NO_CONFIG, ERR_NO_CONFIG)
 
     config = ConfigParser()
     config.read(CONFIG_FILE_PARAMS)
+    return config
 
-    try:
-        behaviour_section = config[CONFIG_SECTION_BEHAVIOUR]
-        mail_on_error     = behaviour_section.getboolean(CONFIG_KEY_BEHAVIOUR_MAIL_ON_ERROR, CONFIG_DEFAULT_BEHAVIOUR_MAIL_ON_ERROR)
-        log_file          = behaviour_section.get(CONFIG_KEY_BEHAVIOUR_LOG_FILE, CONFIG_DEFAULT_BEHAVIOUR_LOG_FILE)
+# Read and check the settings from the config file. When given the settings read previously, they are kept as
+# they are unless the file has changed since, so that a daemon only reads it again when it is edited.
+def load_settings(cli_args, previous=None):
+    mtime = os.path.getmtime(CONFIG_FILE_PARAMS) if os.path.isfile(CONFIG_FILE_PARAMS) else None
+    if previous is not None and mtime == previous.mtime:
+        return previous
+
+    settings = Settings(read_config(), mtime)
 
-        return mail_on_error, log_file
-    except KeyError:
-        return CONFIG_DEFAULT_BEHAVIOUR_MAIL_ON_ERROR, CONFIG_DEFAULT_BEHAVIOUR_LOG_FILE
+    paramlist = [settings.mailgun_key, settings.mailgun_domain, settings.mailgun_from, settings.mailgun_to]
+    if None in paramlist:
+        err_exit("Invailid Mailgun configuration. Please check the config file at " + \
+            CONFIG_FILE_PARAMS + " and see the README for details.", ERR_INVALID_PARAMS)
+    if settings.parser not in (PARSER_STREAM, PARSER_BS4):
+        err_exit("Invalid parser '" + settings.parser + "' in " + CONFIG_FILE_PARAMS + ". Use '" + PARSER_STREAM + \
+            "' or '" + PARSER_BS4 + "'.", ERR_INVALID_PARAMS)
+    if settings.lock not in (LOCK_SKIP, LOCK_WAIT):
+        err_exit("Invalid lock policy '" + settings.lock + "' in " + CONFIG_FILE_PARAMS + ". Use '" + LOCK_SKIP + \
+            "' or '" + LOCK_WAIT + "'.", ERR_INVALID_PARAMS)
+    for source in settings.sources:
+        if not source.url:
+            err_exit("The " + source.name + " source in " + CONFIG_FILE_PARAMS + " has no url.", ERR_INVALID_PARAMS)
+        if source.extractor not in (EXTRACTOR_COMICLIST, EXTRACTOR_TITLES):
+            err_exit("Invalid extractor '" + source.extractor + "' for the " + source.name + " source in " + CONFIG_FILE_PARAMS + \
+                ". Use '" + EXTRACTOR_COMICLIST + "' or '" + EXTRACTOR_TITLES + "'.", ERR_INVALID_PARAMS)
+    if not settings.sources:
+        err_exit("All the release sources are disabled in " + CONFIG_FILE_PARAMS + ".", ERR_INVALID_PARAMS)
+    if cli_args.jobs is not None:
+        settings.jobs = cli_args.jobs
 
-# Read the watched comics list
-def read_watchlist():
-    if not os.path.isfile(CONFIG_FILE_WATCHLIST):
+    if DEBUG_PARAMS in DEBUG:
+        print("Params:", paramlist)
+        print("Mail on error:", settings.mail_on_error)
+        print("Log path:", settings.log_file)
+        print("Cached feed max age:", settings.feed_max_age)
+        print("Parser:", settings.parser)
+        print("Parsing jobs:", settings.jobs)
+        print("Lock policy:", settings.lock, "(" + str(settings.lock_timeout) + "s)" if settings.lock == LOCK_WAIT else '')
+        print("Sources:", [source.name + ' (' + source.url + ')' for source in settings.sources])
+
+    return settings
+
+# Read the text of the watched comics list
+def read_watchlist_text(path=CONFIG_FILE_WATCHLIST):
+    if not os.path.isfile(path):
         err_exit("You have no watched comics. Please place your comics in " + \
-            CONFIG_FILE_WATCHLIST + ". See the README for details.", ERR_NO_WATCHLIST)
+            path + ". See the README for details.", ERR_NO_WATCHLIST)
+
+    with open(path, 'r') as f:
+        return f.read()
+
+# Get the entries of a watchlist's text, skipping blank lines and comments
+def parse_watchlist(text):
+    watchlist = [line.strip() for line in text.splitlines() if line.strip() != '' and not line.strip().startswith('#')]
+    return [watched for watched in watchlist if not is_empty_fuzzy_entry(watched)]
+
+# Whether a watchlist entry is fuzzy with no letters or digits to match, e.g. "~" or "~0.7:". Such an entry would
+# match every comic, so it is skipped with a warning.
+def is_empty_fuzzy_entry(watched):
+    m = FUZZY_ENTRY.fullmatch(watched)
+    if m is None or normalise_title(m.group(2)):
+        return False
+
+    print("Skipping the watchlist entry", repr(watched) + ": it has no letters or digits to match.", file=sys.stderr)
+    return True
+
+# Drop the watchlist entries that repeat an earlier one, ignoring case, and for fuzzy entries, everything else that
+# fuzzy matching ignores
+def dedupe_watchlist(watchlist):
+    seen, unique = set(), []
+    for watched in watchlist:
+        m   = FUZZY_ENTRY.fullmatch(watched)
+        key = (float(m.group(1) or FUZZY_THRESHOLD), normalise_title(m.group(2))) if m else watched.lower()
+        if key not in seen:
+            seen.add(key)
+            unique.append(watched)
+
+    return unique
+
+# Get the matcher for a watchlist, only reading the file again if it has changed since the last call
+def get_watchlist_matcher(path=CONFIG_FILE_WATCHLIST):
+    mtime  = os.path.getmtime(path) if os.path.isfile(path) else None
+    cached = watchlist_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    matcher               = compile_watchlist(path)
+    watchlist_cache[path] = (mtime, matcher)
+    return matcher
+
+# The compiled file of a watchlist, named after the watchlist's full path
+def get_compiled_watchlist_file(path):
+    return os.path.join(DATA_FOLDER_WATCHLISTS, hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest() + '.pickle')
+
+# Read a compiled watchlist, returning None if it is missing, from another version, or corrupt. The file holds
+# nothing but built-in lists, dicts and sets, so no class is ever looked up: a tampered file can't run any code.
+def load_compiled_watchlist(compiled_file):
+    import pickle
+
+    class TablesUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            raise pickle.UnpicklingError(module + '.' + name + ' is not allowed in a compiled watchlist')
 
-    with open(CONFIG_FILE_WATCHLIST, 'r') as f:
-        watchlist = [line.strip() for line in f if line.strip() != '' and not line.strip().startswith('#')]
+    try:
+        with open(compiled_file, 'rb') as f:
+            if f.readline() != COMPILED_WATCHLIST_HEADER:
+                return None
+            compiled = TablesUnpickler(f).load()
+        if isinstance(compiled, dict):
+            compiled['matcher'] = WatchlistMatcher.from_tables(compiled.get('matcher'))
+            if compiled['matcher'] is not None:
+                return compiled
+    except (OSError, IOError, EOFError, ValueError, TypeError, AttributeError, ImportError, IndexError, pickle.UnpicklingError):
+        pass
+
+    return None
+
+# Save a compiled watchlist, replacing the file at once so that it is never read half-written
+def save_compiled_watchlist(compiled_file, compiled):
+    import pickle
 
-    return watchlist
+    try:
+        if not os.path.isdir(DATA_FOLDER_WATCHLISTS):
+            os.makedirs(DATA_FOLDER_WATCHLISTS)
+        with atomic_write(compiled_file, 'wb') as f:
+            f.write(COMPILED_WATCHLIST_HEADER)
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except (OSError, IOError) as e:
+        print("Failed to save the compiled watchlist to", compiled_file + ':', e, file=sys.stderr)
+
+# Get the matcher for a watchlist from its compiled file, compiling it again only if the watchlist's contents
+# have changed since. A compiled file is trusted while the watchlist's modification time and size are the same,
+# and otherwise only if the watchlist hashes the same.
+@timed('watchlist')
+def compile_watchlist(path):
+    compiled_file = get_compiled_watchlist_file(path)
+    compiled      = load_compiled_watchlist(compiled_file)
+    stat          = os.stat(path) if os.path.isfile(path) else None
+    if compiled is not None and stat is not None and \
+            (compiled.get('mtime'), compiled.get('size')) == (stat.st_mtime, stat.st_size):
+        return compiled['matcher']
+
+    text   = read_watchlist_text(path)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    if compiled is not None and compiled.get('sha256') == digest:
+        matcher = compiled['matcher']
+    else:
+        matcher = WatchlistMatcher(dedupe_watchlist(parse_watchlist(text)))
+        metrics.count('watchlists_compiled')
+        if DEBUG != '':
+            print("Compiled the watchlist at", path, "into", compiled_file)
+
+    save_compiled_watchlist(compiled_file, {
+        'path':      os.path.abspath(path),
+        'mtime':     stat.st_mtime,
+        'size':      stat.st_size,
+        'sha256':    digest,
+        'watchlist': matcher.watchlist,
+        'matcher':   matcher.to_tables(),
+    })
+
+    return matcher
+
+# A feed listing comic releases, with how to extract them and where to cache it
+Source = namedtuple('Source', ['name', 'url', 'extractor', 'timeout', 'publisher', 'cache_file', 'meta_file'])
+
+# Read the release sources from the config: ComicList, unless it is disabled, followed by the [source:<name>] sections
+def read_sources(config):
+    names = [SOURCE_COMICLIST] + [section[len(CONFIG_SECTION_SOURCE):] for section in config.sections()
+        if section.startswith(CONFIG_SECTION_SOURCE) and section != CONFIG_SECTION_SOURCE + SOURCE_COMICLIST]
+
+    sources = []
+    for name in names:
+        section = CONFIG_SECTION_SOURCE + name
+        if not config.getboolean(section, CONFIG_KEY_SOURCE_ENABLED, fallback=True):
+            continue
+
+        if name == SOURCE_COMICLIST:
+            url, cache_file, meta_file = FEED_URL, DATA_FILE_FEED_CACHE, DATA_FILE_FEED_META
+        else:
+            url, cache_file, meta_file = None, os.path.join(DATA_FOLDER_SOURCES, name + '.xml'), os.path.join(DATA_FOLDER_SOURCES, name + '.json')
+
+        sources.append(Source(name,
+            config.get(section, CONFIG_KEY_SOURCE_URL, fallback=url),
+            config.get(section, CONFIG_KEY_SOURCE_EXTRACTOR, fallback=EXTRACTOR_COMICLIST),
+            config.getfloat(section, CONFIG_KEY_SOURCE_TIMEOUT, fallback=FEED_TIMEOUT),
+            config.get(section, CONFIG_KEY_SOURCE_PUBLISHER, fallback=name.upper()),
+            cache_file, meta_file))
+
+    return sources
+
+# A user checked as part of a multi-tenant run, with their own recipient, watchlist and state
+Tenant = namedtuple('Tenant', ['name', 'to', 'watchlist', 'log_file', 'log_csv', 'last_update_file'])
+
+# Read all the tenant configs in a folder, skipping (with a warning) any that are incomplete. Tenants keep their
+# CSV log file up to date as set in their config, or by default as set in log_csv.
+def read_tenants(folder, log_csv=CONFIG_DEFAULT_BEHAVIOUR_LOG_CSV):
+    if not os.path.isdir(folder):
+        err_exit("Tenant folder " + folder + " does not exist.", ERR_NO_CONFIG)
+
+    tenants = []
+    for fname in sorted(os.listdir(folder)):
+        if not fname.endswith(CONFIG_EXT_TENANT):
+            continue
+
+        path   = os.path.join(folder, fname)
+        name   = fname[:-len(CONFIG_EXT_TENANT)]
+        config = ConfigParser()
+        config.read(path)
+
+        to        = config.get(CONFIG_SECTION_MAILGUN, CONFIG_KEY_MAILGUN_TO, fallback=None)
+        watchlist = config.get(CONFIG_SECTION_BEHAVIOUR, CONFIG_KEY_BEHAVIOUR_WATCHLIST, fallback=None)
+        if to is None or watchlist is None:
+            print("Skipping tenant", name + ": the config at", path, "needs a recipient and a watchlist.", file=sys.stderr)
+            continue
+
+        # Relative paths are relative to the tenant's config file
+        watchlist = os.path.join(folder, os.path.expanduser(watchlist))
+        log_file  = config.get(CONFIG_SECTION_BEHAVIOUR, CONFIG_KEY_BEHAVIOUR_LOG_FILE,
+            fallback=os.path.join(DATA_FOLDER_TENANTS, name, 'match.log'))
+        log_file  = os.path.join(folder, os.path.expanduser(log_file))
+        log_csv   = config.getboolean(CONFIG_SECTION_BEHAVIOUR, CONFIG_KEY_BEHAVIOUR_LOG_CSV, fallback=log_csv)
+
+        tenants.append(Tenant(name, to, watchlist, log_file, log_csv, os.path.join(DATA_FOLDER_TENANTS, name, 'last_update')))
+
+    return tenants
 
 # Read the date of the last update from the data file
-def get_last_update():
+def get_last_update(path=DATA_FILE_LAST_UPDATE):
     if DEBUG_FORCEUPDATE in DEBUG:
         return None
 
     try:
-        with open(DATA_FILE_LAST_UPDATE, 'r') as f:
+        with open(path, 'r') as f:
             isodate = f.read().strip()
             try:
                 parts   = isodate.split('-')
@@ -170,35 +745,234 @@ def get_last_update():
         return None
 
 # Update the data file with the current date
-def save_last_update():
+def save_last_update(path=DATA_FILE_LAST_UPDATE):
     if DEBUG_FORCEUPDATE in DEBUG:
         return
 
-    if not os.path.isdir(DATA_FOLDER):
-        os.makedirs(DATA_FOLDER)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
 
     try:
-        with open(DATA_FILE_LAST_UPDATE, 'w') as f:
+        with atomic_write(path) as f:
             f.write(date.today().isoformat())
-    except IOError:
+    except (OSError, IOError):
         print("Failed to save update timestamp. The nextrun might include repeating results.\
-            Do you have permissions to write to", DATA_FILE_LAST_UPDATE + '?', file=sys.stderr)
+            Do you have permissions to write to", path + '?', file=sys.stderr)
+
+# Whether the check may save today as the date of the last update, given whether it found new entries. Lists are
+# dated with their release day, so a check that found none keeps the date, or a list coming out later the same day
+# would be taken as already checked. The date is shared by all the sources, so it is also kept while any of them
+# could not be read, or was read from a cache that can be days old; the releases listed since are checked again
+# once every feed is back.
+def may_save_last_update(found):
+    if DEBUG_NOSAVE in DEBUG:
+        return False
+    if not found:
+        if DEBUG != '':
+            print("No new feed entries, keeping the last update")
+        return False
+
+    failed = metrics.counters.get('failed_feeds', 0)
+    cached = metrics.counters.get('cached_feeds', 0)
+    if failed or cached:
+        print("Not saving the last update, as", failed, "feed(s) could not be read and", cached, \
+            "were read from the cache. The next run checks them again.", file=sys.stderr)
+        return False
+
+    return True
+
+# Raised when Mailgun does not accept a message
+class MailError(Exception):
+    pass
+
+# A Mailgun API client that reuses its connection, times out, and retries when the service is busy or down
+class MailgunClient:
+
+    def __init__(self, key, domain, sender, api_url=MAILGUN_API_URL, retries=MAILGUN_RETRIES, backoff=MAILGUN_BACKOFF):
+        import requests
+
+        self.url     = api_url + domain + '/messages'
+        self.sender  = sender
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.auth = ('api', key)
+
+    # How long to wait before retrying, honouring the server's Retry-After if it sends one
+    def retry_wait(self, attempt, resp=None):
+        wait = self.backoff * 2 ** attempt
+        if resp is not None:
+            try:
+                wait = max(wait, float(resp.headers.get('Retry-After', 0)))
+            except ValueError:
+                pass
+        return min(wait, MAILGUN_MAX_WAIT)
 
-# Send an email using the mailgun API
-def send_mailgun(subject, body):
-    if DEBUG_NOMAIL in DEBUG:
-        return 'Emails disabled for debugging.'
+    # Post a message, returning Mailgun's response or raising MailError once the retries are exhausted or retrying
+    # would go past the deadline (a time.time() value)
+    def post(self, data, deadline=None):
+        import requests
 
-    api_url = "https://api.mailgun.net/v3/" + mailgun_domain + "/messages"
+        for attempt in range(self.retries + 1):
+            resp = None
+            try:
+                resp = self.session.post(self.url, data=data, timeout=MAILGUN_TIMEOUT)
+                if resp.status_code == 200:
+                    try:
+                        result = resp.json()
+                    except ValueError:
+                        raise MailError('Mailgun sent an invalid response: ' + resp.text)
+                    if not isinstance(result, dict) or 'id' not in result:
+                        raise MailError('Mailgun did not queue the message: ' + resp.text)
+                    return result
+                elif resp.status_code != 429 and resp.status_code < 500:
+                    raise MailError('Mailgun rejected the message with HTTP ' + str(resp.status_code) + ': ' + resp.text)
+                error = 'HTTP ' + str(resp.status_code)
+            except requests.RequestException as e:
+                # Requests that can never be sent, e.g. to an invalid URL, aren't worth retrying
+                if isinstance(e, ValueError):
+                    raise MailError('Could not send the request to Mailgun: ' + str(e))
+                error = str(e)
+
+            if attempt < self.retries:
+                wait = self.retry_wait(attempt, resp)
+                if deadline is not None and time.time() + wait > deadline:
+                    break
+                print("Mailgun request failed (" + error + "), retrying in", wait, "seconds", file=sys.stderr)
+                time.sleep(wait)
+
+        raise MailError('Mailgun request failed after ' + str(attempt + 1) + ' attempts: ' + error)
+
+    # Send a single email
+    def send(self, to, subject, text, deadline=None):
+        return self.post({'from': self.sender, 'to': [to], 'subject': subject, 'text': text}, deadline)
+
+    # Send the same message to many recipients in as few calls as possible. recipients is a list of (recipient,
+    # variables) pairs, where the variables replace %recipient.<name>% placeholders in the text. Returns the responses.
+    def send_batch(self, recipients, subject, text, deadline=None):
+        return [self.post({
+                'from': self.sender,
+                'to': [to for to, _ in batch],
+                'subject': subject,
+                'text': text,
+                'recipient-variables': json.dumps({parseaddr(to)[1]: v for to, v in batch})}, deadline)
+            for batch in batch_recipients(recipients)]
+
+# Split (recipient, variables) pairs into Mailgun batches, which take at most MAILGUN_BATCH_SIZE recipients and
+# can only have one set of variables per email address
+def batch_recipients(recipients):
+    batch, addresses = [], set()
+    for to, variables in recipients:
+        address = parseaddr(to)[1]
+        if address in addresses or len(batch) == MAILGUN_BATCH_SIZE:
+            yield batch
+            batch, addresses = [], set()
+        batch.append((to, variables))
+        addresses.add(address)
+
+    if batch:
+        yield batch
+
+# Write an email to the outbox, so that it survives until it is delivered. recipients is a list of (recipient,
+# variables) pairs; with variables, the email is sent as a Mailgun batch. Raises OSError if it can't be queued.
+def queue_mail(subject, text, recipients):
+    if not os.path.isdir(DATA_FOLDER_OUTBOX):
+        os.makedirs(DATA_FOLDER_OUTBOX)
+
+    message = {'subject': subject, 'text': text, 'recipients': recipients, 'attempts': 0, 'next_attempt': 0}
+    name    = datetime.now().strftime('%Y%m%d-%H%M%S-%f') + '-' + str(os.getpid()) + '.json'
+    path    = os.path.join(DATA_FOLDER_OUTBOX, name)
+
+    # The outbox never holds a partial message, and a queued message is on disk before the run moves on
+    with atomic_write(path, fsync=True) as f:
+        json.dump(message, f)
+
+    return path
+
+# Deliver one queued email
+@timed('mail')
+def deliver_mail(client, message, deadline):
+    recipients = message['recipients']
+    if len(recipients) == 1 and recipients[0][1] is None:
+        return [client.send(recipients[0][0], message['subject'], message['text'], deadline)]
+    return client.send_batch(recipients, message['subject'], message['text'], deadline)
+
+# Try to deliver the queued emails, unless another process is already delivering them or no mail is to be sent.
+# Returns the number of emails still queued.
+def drain_outbox(settings, budget=OUTBOX_SEND_BUDGET):
+    if not os.path.isdir(DATA_FOLDER_OUTBOX):
+        return 0
+    if DEBUG_NOMAIL in DEBUG:
+        if DEBUG:
+            print("Not delivering the queued emails")
+        return len([f for f in os.listdir(DATA_FOLDER_OUTBOX) if f.endswith('.json')])
 
-    return requests.post(api_url, auth=("api", mailgun_key), data={
-            "from": mailgun_from,
-            "to": [mailgun_to],
-            "subject": subject,
-            "text": body})
+    # Only one process goes through the outbox at a time, so that no email is sent twice
+    with file_lock(DATA_FILE_OUTBOX_LOCK) as locked:
+        if locked:
+            return send_queued_mail(settings, budget)
 
-# Send an error email when the check cannot be performed
-def send_mail_error(errcode, msg=None):
+    if DEBUG:
+        print("Another process is delivering the queued emails")
+    return len([f for f in os.listdir(DATA_FOLDER_OUTBOX) if f.endswith('.json')])
+
+# Deliver the queued emails, oldest first, spending at most budget seconds on it. Emails that fail are left in
+# the outbox for the next run, or moved to the failed folder once they have been tried too many times. Returns
+# the number of emails still queued.
+def send_queued_mail(settings, budget):
+    client = settings.mail_client()
+
+    deadline = time.time() + budget
+    pending  = sorted(f for f in os.listdir(DATA_FOLDER_OUTBOX) if f.endswith('.json'))
+    for name in pending[:]:
+        path = os.path.join(DATA_FOLDER_OUTBOX, name)
+        try:
+            with open(path, 'r') as f:
+                message = json.load(f)
+        except (OSError, IOError, ValueError) as e:
+            print("Skipping unreadable queued email", path + ':', e, file=sys.stderr)
+            continue
+
+        if message.get('next_attempt', 0) > time.time():
+            continue
+        if time.time() >= deadline:
+            break
+
+        try:
+            resp = deliver_mail(client, message, deadline)
+            os.remove(path)
+            pending.remove(name)
+            metrics.count('mails_delivered')
+            if DEBUG:
+                print("Delivered", message['subject'], "to", len(message['recipients']), "recipient(s). Reponse was:", resp)
+            continue
+        except MailError as e:
+            print("Could not deliver queued email", name + ':', e, file=sys.stderr)
+            metrics.count('mails_failed')
+
+        # Back off exponentially between runs, and give up after too many attempts
+        message['attempts']     = message.get('attempts', 0) + 1
+        message['next_attempt'] = time.time() + min(60 * 2 ** message['attempts'], OUTBOX_MAX_DELAY)
+        try:
+            if message['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+                if not os.path.isdir(DATA_FOLDER_FAILED):
+                    os.makedirs(DATA_FOLDER_FAILED)
+                os.replace(path, os.path.join(DATA_FOLDER_FAILED, name))
+                pending.remove(name)
+                print("Gave up on queued email", name, "after", message['attempts'], "attempts", file=sys.stderr)
+            else:
+                with atomic_write(path, fsync=True) as f:
+                    json.dump(message, f)
+        except (OSError, IOError) as e:
+            print("Could not update queued email", name + ':', e, file=sys.stderr)
+
+    if pending:
+        print(len(pending), "email(s) are still queued in", DATA_FOLDER_OUTBOX, "and will be retried on the next run.", file=sys.stderr)
+
+    return len(pending)
+
+# Queue an error email when the check cannot be performed, and try to deliver it without holding up the exit
+def send_mail_error(settings, errcode, msg=None):
     body = MAILGUN_BODY_ERROR.replace('$e', str(errcode))
 
     if errcode == ERR_NO_FEED:
@@ -211,85 +985,1126 @@ def send_mail_error(errcode, msg=None):
         err_msg = ERR_MSG_GENERIC
     body = body.replace('$m', err_msg)
 
-    resp = send_mailgun(MAILGUN_SUBJECT_ERROR, body)
-
     if DEBUG:
-        print("Sent error mail to", mailgun_to, 'for code', errcode, 'explaining that:', err_msg)
-        print("Reponse was:", resp)
+        print("Sending error mail to", settings.mailgun_to, 'for code', errcode, 'explaining that:', err_msg)
+    if DEBUG_NOMAIL in DEBUG:
+        return
+
+    try:
+        queue_mail(MAILGUN_SUBJECT_ERROR, body, [(settings.mailgun_to, None)])
+    except (OSError, IOError) as e:
+        print("Could not queue the error mail:", e, file=sys.stderr)
+        return
+    drain_outbox(settings, OUTBOX_ERROR_BUDGET)
+
+# Mail the error that stopped a check, if the settings ask for it. Errors that mailing can't help with are not sent.
+def report_error(settings, error):
+    if settings is not None and settings.mail_on_error and error.code not in (ERR_NO_CONFIG, ERR_MAIL_FAILED):
+        send_mail_error(settings, error.code, error.msg)
+
+# Get the body of the update email listing the matched comics
+def get_mail_update_body(comics):
+    comics_list = '\n'.join(['  * ' + c.title for c in sorted(comics, key=lambda c: c.title)])
+    return MAILGUN_BODY_UPDATE.replace('$n', str(len(comics))).replace('$c', comics_list)
 
-# Send an update email when matched comics are found
-def send_mail_update(comics):
-    comics_list = '\n'.join(['  * ' + c for c in sorted(comics)])
-    body        = MAILGUN_BODY_UPDATE.replace('$n', str(len(comics))).replace('$c', comics_list)
+# Queue an update email when matched comics are found. It is delivered by drain_outbox().
+def send_mail_update(comics, to):
+    send_mail_updates([(to, comics)])
 
-    resp = send_mailgun(MAILGUN_SUBJECT_UPDATE, body)
+# Queue the update emails of many recipients, to be delivered using Mailgun's batch sending. updates is a list of
+# (recipient, matched comics) pairs. Exits if the emails can't be queued, before any state is saved.
+def send_mail_updates(updates):
+    bodies = [(to, {'body': get_mail_update_body(comics)}) for to, comics in updates]
 
     if DEBUG:
-        print("Sent update mail to", mailgun_to, 'for', len(comics), 'comics:\n' + comics_list)
-        print("Reponse was:", resp)
+        for to, variables in bodies:
+            print("Queueing update mail to", to + ':\n' + variables['body'])
+    if DEBUG_NOMAIL in DEBUG:
+        return
+
+    try:
+        if len(bodies) == 1:
+            queue_mail(MAILGUN_SUBJECT_UPDATE, bodies[0][1]['body'], [(bodies[0][0], None)])
+        else:
+            for batch in batch_recipients(bodies):
+                queue_mail(MAILGUN_SUBJECT_UPDATE, '%recipient.body%', batch)
+    except (OSError, IOError) as e:
+        err_exit("Could not queue the update mail in " + DATA_FOLDER_OUTBOX + ": " + str(e), ERR_MAIL_FAILED)
+
 
+# The key identifying a feed entry across fetches of its feed
+def get_entry_key(entry):
+    return entry.get('id') or entry.get('link') or entry.title
 
-# Get the date from an entry's title
+# Get the date from an entry's title, or when it was published if the title has none
 def get_entry_date(entry):
-    r = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
-    m = r.search(entry.title)
-    return date(*[int(i) for i in r.search(entry.title).group(3, 1, 2)])
+    m = ENTRY_DATE.search(entry.get('title', ''))
+    if m is None:
+        return get_published_date(entry)
+    return date(int(m.group(3)), int(m.group(1)), int(m.group(2)))
+
+# Get the date an entry was published, for feeds that don't date their titles. Undated entries count as new.
+def get_published_date(entry):
+    published = entry.get('published_parsed') or entry.get('updated_parsed')
+    return date(*published[:3]) if published else date.today()
+
+# Get the release date of an entry of a source
+def get_source_date(source, entry):
+    if source.extractor == EXTRACTOR_TITLES:
+        return get_published_date(entry)
+    return get_entry_date(entry)
+
+# The release dates of a feed's entries, sorted so that the entries released in a range of dates are found by
+# bisection rather than by dating every entry. It is built once per copy of a feed, and saved alongside it.
+class EntryIndex:
+
+    def __init__(self, dates, positions, keys):
+        self.dates     = dates     # Date ordinals, sorted
+        self.positions = positions # The position of each of those entries in the feed
+        self.keys      = keys      # The key of each of those entries
+
+    @classmethod
+    def build(cls, source, entries):
+        dated = sorted((get_source_date(source, e).toordinal(), i, get_entry_key(e)) for i, e in enumerate(entries))
+        return cls([d for d, _, _ in dated], [i for _, i, _ in dated], [k for _, _, k in dated])
+
+    # Read an index saved with to_json(), returning None if it is missing or invalid
+    @classmethod
+    def from_json(cls, data):
+        try:
+            index = cls(data['dates'], data['positions'], data['keys'])
+            return index if len(index.dates) == len(index.positions) == len(index.keys) else None
+        except (KeyError, TypeError):
+            return None
+
+    def to_json(self):
+        return {'dates': self.dates, 'positions': self.positions, 'keys': self.keys}
+
+    # Whether the index describes the entries of a feed
+    def fits(self, feed):
+        return len(self.positions) == len(feed.entries)
+
+    # The latest release date, or None if the feed has no entries
+    def latest(self):
+        return date.fromordinal(self.dates[-1]) if self.dates else None
+
+    # Find the entries released from start to end, either of which may be None for no limit. Returns their
+    # (position, release date, key), in feed order.
+    def between(self, start=None, end=None):
+        lo = 0 if start is None else bisect.bisect_left(self.dates, start.toordinal())
+        hi = len(self.dates) if end is None else bisect.bisect_right(self.dates, end.toordinal())
+        return sorted((self.positions[i], date.fromordinal(self.dates[i]), self.keys[i]) for i in range(lo, hi))
+
+# Get the index of a feed's entries, building it if the saved one is missing or doesn't fit the feed
+def get_entry_index(source, feed, index=None):
+    return index if index is not None and index.fits(feed) else EntryIndex.build(source, feed.entries)
+
+# Read the validators and timestamps of a source's cached feed
+def read_feed_meta(source):
+    try:
+        with open(source.meta_file, 'r') as f:
+            meta = json.load(f)
+        if isinstance(meta, dict) and os.path.isfile(source.cache_file):
+            return meta
+    except (OSError, IOError, ValueError):
+        pass
+
+    return {}
+
+# Read the cached copy of a source's feed
+def read_feed_cache(source):
+    try:
+        with open(source.cache_file, 'rb') as f:
+            return f.read()
+    except (OSError, IOError):
+        return None
+
+# Store a good copy of the feed with its validators and entry index, to be used for conditional requests and as
+# a fallback
+def save_feed_cache(source, body, headers, index):
+    if DEBUG_NOSAVE in DEBUG:
+        return
+
+    meta = {
+        'etag':     headers.get('ETag'),
+        'modified': headers.get('Last-Modified'),
+        'type':     headers.get('Content-Type'),
+        'fetched':  date.today().isoformat(),
+        'checked':  time.time(),
+        'index':    index.to_json(),
+    }
+
+    try:
+        if not os.path.isdir(os.path.dirname(source.cache_file)):
+            os.makedirs(os.path.dirname(source.cache_file))
+        # Replace the files at once, as the cached copy is the fallback when the feed can't be fetched
+        with atomic_write(source.cache_file, 'wb') as f:
+            f.write(body)
+        with atomic_write(source.meta_file) as f:
+            json.dump(meta, f)
+    except (OSError, IOError):
+        print("Failed to cache the", source.name, "feed in", source.cache_file + '. The next run will download it again.', file=sys.stderr)
+
+# Record that the cached feed is still current, after the server answered with a 304
+def touch_feed_cache(source, meta):
+    if DEBUG_NOSAVE in DEBUG:
+        return
+
+    meta['checked'] = time.time()
+    try:
+        with atomic_write(source.meta_file) as f:
+            json.dump(meta, f)
+    except (OSError, IOError):
+        pass
+
+# The folder holding the archived copies of a source's feed
+def get_archive_folder(source):
+    return os.path.join(DATA_FOLDER_ARCHIVE, source.name)
+
+# Read the entry indexes of a source's archived feeds, by file name
+def read_archive_index(source):
+    try:
+        with open(os.path.join(get_archive_folder(source), ARCHIVE_INDEX), 'r') as f:
+            indexes = json.load(f)
+        if isinstance(indexes, dict):
+            return indexes
+    except (OSError, IOError, ValueError):
+        pass
+
+    return {}
+
+# Save the entry indexes of a source's archived feeds
+def save_archive_index(source, indexes):
+    path = os.path.join(get_archive_folder(source), ARCHIVE_INDEX)
+    try:
+        with atomic_write(path) as f:
+            json.dump(indexes, f)
+    except (OSError, IOError) as e:
+        print("Failed to save the archive index", path + ':', e, file=sys.stderr)
+
+# Keep a compressed copy of a source's feed for --replay, with the index of its entries. A feed is only archived
+# again once its contents change, and copies older than ARCHIVE_MAX_AGE days are removed.
+def archive_feed(source, body, index):
+    if DEBUG_NOSAVE in DEBUG:
+        return
+
+    import gzip
+
+    folder = get_archive_folder(source)
+    digest = hashlib.sha1(body).hexdigest()[:16]
+    oldest = (date.today() - timedelta(days=ARCHIVE_MAX_AGE)).isoformat()
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        names = []
+        for name in os.listdir(folder):
+            if name != ARCHIVE_INDEX and name < oldest:
+                os.remove(os.path.join(folder, name))
+            elif name.endswith(ARCHIVE_EXT):
+                names.append(name)
+        if any(name.endswith('-' + digest + ARCHIVE_EXT) for name in names):
+            return
+
+        name = date.today().isoformat() + '-' + digest + ARCHIVE_EXT
+        path = os.path.join(folder, name)
+        with atomic_write(path, 'wb') as raw, gzip.GzipFile(name[:-len('.gz')], 'wb', fileobj=raw) as f:
+            f.write(body)
+    except (OSError, IOError) as e:
+        print("Failed to archive the", source.name, "feed in", folder + ':', e, file=sys.stderr)
+        return
+
+    indexes = {n: data for n, data in read_archive_index(source).items() if n in names}
+    indexes[name] = index.to_json()
+    save_archive_index(source, indexes)
+
+# List the archived copies of a source's feed as (day fetched, path, saved entry index) tuples, newest first. The
+# cached copy is included unless it is archived already, so that a feed fetched before archiving started can be
+# replayed too.
+def list_feed_archive(source):
+    folder    = get_archive_folder(source)
+    names     = sorted((n for n in os.listdir(folder) if n.endswith(ARCHIVE_EXT)), reverse=True) if os.path.isdir(folder) else []
+    indexes   = read_archive_index(source)
+    snapshots = [(datetime.strptime(n[:10], '%Y-%m-%d').date(), os.path.join(folder, n), indexes.get(n)) for n in names]
+
+    meta = read_feed_meta(source)
+    body = read_feed_cache(source) if meta.get('fetched') else None
+    if body is not None and not any(n.endswith('-' + hashlib.sha1(body).hexdigest()[:16] + ARCHIVE_EXT) for n in names):
+        snapshots.append((datetime.strptime(meta['fetched'], '%Y-%m-%d').date(), source.cache_file, meta.get('index')))
+        snapshots.sort(key=lambda s: s[0], reverse=True)
+
+    return snapshots
+
+# Read an archived copy of a feed, returning None if it can't be used
+def read_archived_feed(path):
+    import gzip
+    import zlib
+
+    try:
+        with (gzip.open(path, 'rb') if path.endswith(ARCHIVE_EXT) else open(path, 'rb')) as f:
+            return parse_feed(f.read())
+    except (OSError, IOError, EOFError, zlib.error) as e:
+        print("Skipping the unreadable archived feed", path + ':', e, file=sys.stderr)
+        return None
+
+# Get the archived entries of a source released from start to end, newest first, each from its most recent copy.
+# Without a start, the week up to the source's latest release is used. Returns the dates used and the entries.
+# A copy is only parsed if its index lists entries in range that haven't been found in a newer copy.
+def get_archived_entries(source, start=None, end=None):
+    entries, seen, built = [], set(), {}
+    for fetched, path, data in list_feed_archive(source):
+        # A feed lists the releases up to a week after it was fetched, so older copies can't have any in range
+        if start is not None and fetched + timedelta(days=7) < start:
+            break
+
+        feed  = None
+        index = EntryIndex.from_json(data)
+        if index is None:
+            feed = read_archived_feed(path)
+            if feed is None:
+                continue
+            index = EntryIndex.build(source, feed.entries)
+            if path != source.cache_file:
+                built[os.path.basename(path)] = index.to_json()
+
+        if start is None:
+            if index.latest() is None:
+                continue
+            end   = index.latest()
+            start = end - timedelta(days=6)
+
+        wanted = [(i, d, key) for i, d, key in index.between(start, end) if key not in seen]
+        if not wanted:
+            continue
+
+        feed = feed or read_archived_feed(path)
+        if feed is None:
+            continue
+        if not index.fits(feed):
+            index  = EntryIndex.build(source, feed.entries)
+            wanted = [(i, d, key) for i, d, key in index.between(start, end) if key not in seen]
+        metrics.count('archived_feeds')
+
+        for i, d, key in wanted:
+            seen.add(key)
+            entries.append((d, feed.entries[i]))
+
+    # Save the indexes of the copies archived without one, so that they are only parsed when needed next time
+    if built:
+        indexes = read_archive_index(source)
+        indexes.update(built)
+        save_archive_index(source, indexes)
+
+    entries.sort(key=lambda de: de[0], reverse=True)
+    return start, end, [e for _, e in entries]
+
+# Get the HTTP session used for a source, which keeps its connections open between the checks of a daemon.
+# Each source has its own, as they are fetched from different threads.
+def get_http_session(source):
+    import requests
+
+    if source.name not in http_sessions:
+        http_sessions[source.name] = requests.Session()
+    return http_sessions[source.name]
+
+# Download a source's feed, sending the cached validators so that the server can answer with a 304.
+# Returns the response, or None if the feed could not be fetched.
+def fetch_feed(source, meta):
+    import requests
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('modified'):
+        headers['If-Modified-Since'] = meta['modified']
+
+    try:
+        resp = get_http_session(source).get(source.url, headers=headers, timeout=source.timeout * FEED_REQUEST_SHARE)
+    except requests.RequestException as e:
+        print("Could not fetch the", source.name, "feed:", e, file=sys.stderr)
+        return None
+
+    metrics.count('feed_bytes', len(resp.content))
+
+    if resp.status_code not in (200, 304):
+        print("Could not fetch the", source.name, "feed: HTTP", resp.status_code, file=sys.stderr)
+        return None
+
+    return resp
+
+# Parse the feed contents, returning None if they are not a usable feed
+def parse_feed(body, content_type=None):
+    if body is None:
+        return None
 
-# Get the RSS feed
-def get_rss_entries(since=None):
-    feed = feedparser.parse(FEED_URL)
+    import feedparser
+    feed = feedparser.parse(body, response_headers={'content-type': content_type} if content_type else None)
     if len(feed.entries) == 0 or 'bozo_exception' in feed:
-        err_exit("Could not retrieve feed contents. Is your URL working?", ERR_NO_FEED)
+        return None
+    return feed
+
+# Use the cached copy of a source's feed when the live one is unavailable, as long as it is recent enough
+def read_cached_feed(source, meta, max_age):
+    if not meta:
+        return None
+
+    age = (time.time() - meta.get('checked', 0)) / (24 * 60 * 60)
+    if age > max_age:
+        print("The cached", source.name, "feed is too old to use:", round(age, 1), "days", file=sys.stderr)
+        return None
+
+    print("Using the cached", source.name, "feed from", meta.get('fetched'), file=sys.stderr)
+    feed = parse_feed(read_feed_cache(source), meta.get('type'))
+    if feed is not None:
+        metrics.count('cached_feeds')
+    return feed
 
+# Get the entries of a feed newer than since, in feed order, or None if there is no feed. The entries are looked up
+# in the feed's saved index, if it still fits the feed.
+def get_new_entries(source, feed, since, index=None):
+    if feed is None:
+        return None
     if since is None:
-        return feed.entries
-    else:
-        return [e for e in feed.entries if get_entry_date(e) > since]
+        return iter(feed.entries)
+
+    index = get_entry_index(source, feed, index)
+    return iter([feed.entries[i] for i, _, _ in index.between(since + timedelta(days=1))])
+
+# Get the entries of a source's feed newer than since, or None if neither the feed nor its cache can be used.
+# Once the check has given up waiting and set cancelled, the fetch leaves the cache as it is: the check has
+# used the cached copy instead, so the next one must not take the new copy as already checked.
+def get_source_entries(source, since, max_age, cancelled=None):
+    meta = read_feed_meta(source)
+    resp = fetch_feed(source, meta)
+    feed = None
 
-def parse_comic_list(entries):
-    return list(itertools.chain.from_iterable([soup(e.summary, 'html.parser').find_all('p')[4].stripped_strings for e in entries]))
+    if cancelled is not None and cancelled.is_set():
+        return None
+    if resp is not None and resp.status_code == 304:
+        touch_feed_cache(source, meta)
+
+        # Nothing changed since the cached copy, which a previous run has already checked
+        if since is not None and meta.get('fetched', '') <= since.isoformat():
+            if DEBUG != '':
+                print("The", source.name, "feed is not modified since", meta.get('fetched'))
+            return iter([])
+        feed = parse_feed(read_feed_cache(source), meta.get('type'))
+    elif resp is not None:
+        feed = parse_feed(resp.content, resp.headers.get('Content-Type'))
+        if cancelled is not None and cancelled.is_set():
+            return None
+        if feed is not None:
+            index = EntryIndex.build(source, feed.entries)
+            save_feed_cache(source, resp.content, resp.headers, index)
+            archive_feed(source, resp.content, index)
+            return get_new_entries(source, feed, since, index)
+
+    if feed is None:
+        feed = read_cached_feed(source, meta, max_age)
+
+    return get_new_entries(source, feed, since, EntryIndex.from_json(meta.get('index')))
+
+# Get the entries of a source's cached feed newer than since, or None if it can't be used
+def get_cached_entries(source, since, max_age):
+    meta = read_feed_meta(source)
+    return get_new_entries(source, read_cached_feed(source, meta, max_age), since, EntryIndex.from_json(meta.get('index')))
+
+# Get a source's entries in a worker thread, falling back to its cache if it takes longer than its timeout. The
+# worker can't be stopped, so it is told to leave the cache alone when it finishes.
+async def fetch_source(loop, source, since, max_age):
+    import asyncio
+
+    cancelled = threading.Event()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(None, get_source_entries, source, since, max_age, cancelled), source.timeout)
+    except asyncio.TimeoutError:
+        cancelled.set()
+        print("Timed out fetching the", source.name, "feed after", source.timeout, "seconds", file=sys.stderr)
+    except Exception:
+        print("Could not read the", source.name, "feed:", file=sys.stderr)
+        traceback.print_exc()
+
+    try:
+        return await loop.run_in_executor(None, get_cached_entries, source, since, max_age)
+    except Exception:
+        traceback.print_exc()
+        return None
 
-# Return a list of the comics matched from the watchlist
-def match_comics(comics, watchlist, only_once=True):
-    # Filter based on watchlist
-    matched = [c for watched in watchlist for c in comics if watched.lower() in c.lower()]
+# Get the new entries of all the sources, fetching them concurrently. Returns (source, entries) pairs for the
+# sources that could be read, where the entries are read one at a time as they are used; the check only fails
+# when none of the sources could be read.
+@timed('fetch')
+def get_rss_entries(sources, since, max_age):
+    import asyncio
 
-    # Remove non-comics from list, e.g. games and merch
-    matched = [c.split(',')[2] for c in matched if c.split(',')[1].upper() == c.split(',')[1]]
+    async def fetch_all():
+        return await asyncio.gather(*[fetch_source(loop, source, since, max_age) for source in sources])
 
-    # There may be several variants of the same comic being released at the same time, so it is often
-    # redundant to consider all titles that match
-    if only_once:
-        # Keep the title only
-        title_only = re.compile(r'[^#]+#[\d]+')
-        matched = [title_only.match(c).group() for c in matched if title_only.match(c)]
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(fetch_all())
+    finally:
+        loop.close()
 
-        # Remove duplicates
-        matched = list(set(matched))
+    fetched = [(source, entries) for source, entries in zip(sources, results) if entries is not None]
+    if not fetched:
+        err_exit("Could not retrieve feed contents. Is your URL working?", ERR_NO_FEED)
+    if len(fetched) < len(sources):
+        metrics.count('failed_feeds', len(sources) - len(fetched))
 
-    return matched
+    return fetched
 
-# Saved matched comics in a csv log file
-def save_match_log(matches):
-    write_headers, write_mode = False, 'a'
+# Read the parse cache, mapping each entry's key to the hash of its summary and the comics extracted from it
+def load_parse_cache():
+    try:
+        with open(DATA_FILE_PARSE_CACHE, 'r') as f:
+            cache = json.load(f, object_pairs_hook=OrderedDict)
+        if isinstance(cache, OrderedDict):
+            return cache
+    except (OSError, IOError, ValueError):
+        pass
+
+    return OrderedDict()
+
+# The size of the parse cache, counted as the characters of its comic lines
+def get_parse_cache_size(cache):
+    return sum(len(line) for _, comics in cache.values() for line in comics)
+
+# Evict the least recently used entries of the parse cache until it is no larger than PARSE_CACHE_MAX_SIZE.
+# Returns its new size.
+def evict_parse_cache(cache, size):
+    while size > PARSE_CACHE_MAX_SIZE and cache:
+        _, (_, comics) = cache.popitem(last=False)
+        size          -= sum(len(line) for line in comics)
+    return size
+
+# Save the parse cache, evicting the least recently used entries if it has grown too large
+def save_parse_cache(cache):
+    evict_parse_cache(cache, get_parse_cache_size(cache))
 
     try:
-        # Create directories as needed
-        if not os.path.exists(os.path.dirname(behaviour_log_file)):
-            os.makedirs(os.path.dirname(behaviour_log_file))
+        if not os.path.isdir(DATA_FOLDER):
+            os.makedirs(DATA_FOLDER)
+        with atomic_write(DATA_FILE_PARSE_CACHE) as f:
+            json.dump(cache, f)
+    except (OSError, IOError):
+        print("Failed to save the parse cache to", DATA_FILE_PARSE_CACHE + '.', file=sys.stderr)
+
+# Raised by the paragraph extractor to stop tokenizing once its paragraph has closed
+class ParagraphDone(Exception):
+    pass
+
+# Streaming extractor for the stripped strings of the n-th paragraph of a document. It mirrors the tree
+# html.parser would give BeautifulSoup, without building it: an end tag closes every element opened after
+# its matching start tag, and unmatched end tags are ignored.
+class ParagraphExtractor(HTMLParser):
+    VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+    def __init__(self, index):
+        super().__init__(convert_charrefs=True)
+        self.index   = index
+        self.count   = 0    # The number of paragraphs seen so far
+        self.stack   = []   # The elements currently open
+        self.target  = None # The position of the wanted paragraph in the stack, while it is open
+        self.strings = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'p':
+            if self.count == self.index:
+                self.target = len(self.stack)
+            self.count += 1
+
+        if tag not in self.VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+
+        pos = len(self.stack) - 1 - self.stack[::-1].index(tag)
+        del self.stack[pos:]
+        if self.target is not None and pos <= self.target:
+            raise ParagraphDone()
+
+    def handle_data(self, data):
+        if self.target is not None:
+            data = data.strip()
+            if data:
+                self.strings.append(data)
+
+    # Return the paragraph's stripped strings, raising IndexError if the document has too few paragraphs
+    def extract(self, html):
+        try:
+            self.feed(html)
+            self.close()
+        except ParagraphDone:
+            pass
+
+        if self.count <= self.index:
+            raise IndexError('paragraph ' + str(self.index) + ' not found')
+
+        return self.strings
+
+# Extract the list of comics from a single entry's summary
+def extract_comics(summary, parser=PARSER_STREAM):
+    if parser == PARSER_BS4:
+        from bs4 import BeautifulSoup as soup
+        return list(soup(summary, 'html.parser').find_all('p')[FEED_COMICS_PARAGRAPH].stripped_strings)
+
+    return ParagraphExtractor(FEED_COMICS_PARAGRAPH).extract(summary)
+
+# The number of processes worth parsing the given number of entries with, using up to jobs of them
+def get_parse_workers(jobs, count):
+    return min(jobs, count, os.cpu_count() or 1) if count >= PARALLEL_MIN_ENTRIES else 1
+
+# Extract the comics from many summaries, in order, spreading the work across processes if there are enough of them.
+# The processes are those of the given pool, or otherwise started for this call only.
+def extract_all_comics(summaries, parser=PARSER_STREAM, jobs=1, pool=None):
+    jobs = get_parse_workers(jobs, len(summaries))
+    if jobs <= 1:
+        return [extract_comics(summary, parser) for summary in summaries]
+
+    # A few chunks per worker keep the load balanced without paying for a round trip per entry
+    extract   = partial(extract_comics, parser=parser)
+    chunksize = max(1, len(summaries) // (jobs * 4))
+    if pool is not None:
+        return list(pool.map(extract, summaries, chunksize=chunksize))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(extract, summaries, chunksize=chunksize))
+
+# Extract the comics of each entry, yielding (entry, comics) pairs in order. Only the entries that are new or have
+# changed since they were cached are parsed, one at a time, or a batch at a time when they can be spread across
+# processes. The processes are started for the first batch that needs them, and kept for the following ones.
+@timed('parse')
+def parse_entries(entries, parser=PARSER_STREAM, jobs=1):
+    cache = load_parse_cache()
+    size  = get_parse_cache_size(cache)
+    seen  = False
+    pool  = None
+
+    try:
+        for batch in batched(entries, PARSE_BATCH_SIZE if jobs > 1 else 1):
+            results = []
+            misses  = [] # (position, key, digest, summary) of the entries that need parsing
+
+            for e in batch:
+                key    = get_entry_key(e)
+                digest = hashlib.sha1(e.summary.encode('utf-8')).hexdigest()
+
+                cached = cache.get(key)
+                if cached is not None and cached[0] == digest:
+                    results.append(cached[1])
+                    cache.move_to_end(key)
+                else:
+                    results.append(None)
+                    misses.append((len(results) - 1, key, digest, e.summary))
+
+            if pool is None and get_parse_workers(jobs, len(misses)) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                pool = ProcessPoolExecutor(max_workers=get_parse_workers(jobs, PARSE_BATCH_SIZE))
+
+            parsed = extract_all_comics([summary for _, _, _, summary in misses], parser, jobs, pool)
+            for (i, key, digest, _), comics in zip(misses, parsed):
+                results[i] = comics
+                cache[key] = [digest, comics]
+                size      += sum(len(line) for line in comics)
+
+            # Keep the cache within its size as it grows, rather than when it is saved
+            size = evict_parse_cache(cache, size)
+            seen = True
+
+            metrics.count('entries_parsed', len(misses))
+            metrics.count('entries_cached', len(batch) - len(misses))
+            metrics.count('comics', sum(len(comics) for comics in results))
+
+            for e, comics in zip(batch, results):
+                yield e, comics
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if seen:
+        save_parse_cache(cache)
+
+# A line of the release list, split into its fields once. The line looks like
+# "date,PUBLISHER,Title #1 Variant Cover,$3.99"; base is "Title #1" and issue is 1, or both are None if the
+# title has no issue number.
+class ComicRecord(namedtuple('ComicRecord', ['line', 'publisher', 'title', 'base', 'issue', 'variant', 'price'])):
+    __slots__ = ()
+
+    # Non-comics, e.g. games and merch, are listed under publishers that aren't in capitals
+    @property
+    def is_comic(self):
+        return self.publisher.upper() == self.publisher
+
+    # The same comic, shown as its main edition
+    def main_edition(self):
+        return self._replace(title=self.base, variant=False)
+
+# Parse a line of the release list, returning None if it doesn't have the expected fields
+def parse_comic_record(line):
+    fields = line.split(',')
+    if len(fields) < 3:
+        return None
+
+    title = fields[2]
+    m     = COMIC_TITLE_ONLY.match(title)
+    base  = m.group() if m else None
+    issue = int(base[base.rindex('#') + 1:]) if m else None
+    price = fields[-1] if len(fields) > 3 else ''
+
+    return ComicRecord(line, fields[1], title, base, issue, base is not None and title != base, price)
+
+# Normalise a title for comparison, keeping only its lowercased letters and digits
+def normalise_title(title):
+    return ''.join(ch for ch in title.lower() if ch.isalnum())
+
+# Turn a list of release lines into comic records, dropping the lines that aren't comics listings
+def parse_comic_records(lines):
+    return [r for r in map(parse_comic_record, lines) if r is not None]
 
-        # If the log file hasn't been used before, write the headers
-        if not os.path.isfile(behaviour_log_file) or os.path.getsize(behaviour_log_file) == 0:
-            write_headers, write_mode = True, 'w'
+# Build a release line in the ComicList format from an entry titled after a comic
+def get_title_line(entry, when, publisher):
+    return ','.join([when.strftime('%m/%d/%Y'), publisher, entry.title.replace(',', ''), ''])
+
+# Extract the comic records of each of a source's entries, yielding (release date, records) pairs
+def parse_source_entries(source, entries, settings):
+    if source.extractor == EXTRACTOR_TITLES:
+        for e in entries:
+            d = get_source_date(source, e)
+            yield d, parse_comic_records([get_title_line(e, d, source.publisher)])
+    else:
+        for e, lines in parse_entries(entries, settings.parser, settings.jobs):
+            yield get_source_date(source, e), parse_comic_records(lines)
+
+# Extract the comic records of the entries fetched from every source, yielding (release date, records) pairs one
+# entry at a time
+def parse_sources(fetched, settings):
+    for source, entries in fetched:
+        yield from parse_source_entries(source, counted(entries, 'entries'), settings)
+
+# Get the comics of the entries fetched from every source, one at a time
+def parse_comic_list(fetched, settings):
+    return itertools.chain.from_iterable(records for _, records in parse_sources(fetched, settings))
+
+# Get the set of character trigrams of a normalised title
+def get_trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# Aho-Corasick automaton matching all the watchlist entries against a comic line in a single pass, with an
+# inverted index of trigrams for the fuzzy entries
+class WatchlistMatcher:
+
+    def __init__(self, watchlist):
+        self.watchlist = list(watchlist)
+        exact, fuzzy   = [], []
+        for i, watched in enumerate(self.watchlist):
+            m = FUZZY_ENTRY.fullmatch(watched)
+            if m and not normalise_title(m.group(2)):
+                continue # Nothing to match; parse_watchlist() warns about these
+            elif m:
+                fuzzy.append((i, float(m.group(1)) if m.group(1) else FUZZY_THRESHOLD, normalise_title(m.group(2))))
+            else:
+                exact.append((i, watched))
+
+        # Build the trie of lowercased patterns; each node is a dict of transitions, and outputs[n] holds
+        # the indices of the watchlist entries ending at node n
+        self.goto    = [{}]
+        self.outputs = [[]]
+        for i, watched in exact:
+            node = 0
+            for ch in watched.lower():
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.outputs.append([])
+                node = nxt
+            self.outputs[node].append(i)
+
+        # Compute the failure links breadth-first, merging the outputs of each node's longest proper suffix
+        self.fail = [0] * len(self.goto)
+        queue     = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt]     = self.goto[f].get(ch, 0)
+                self.outputs[nxt] += self.outputs[self.fail[nxt]]
+                queue.append(nxt)
+
+        # An empty entry matches every line, as with the `in` operator
+        self.always = self.outputs[0]
+
+        # Index the fuzzy entries by their trigrams, so that a line is only scored against the entries it could
+        # match. An entry needing k of its n trigrams can't match a line sharing none of any n - k + 1 of them, so
+        # only its rarest n - k + 1 trigrams are indexed. Entries too short to have any are matched as normalised
+        # substrings.
+        self.thresholds = {i: threshold for i, threshold, _ in fuzzy}
+        self.trigrams   = {i: frozenset(get_trigrams(text)) for i, _, text in fuzzy}
+        self.short      = [(i, text) for i, _, text in fuzzy if not self.trigrams[i]]
+
+        counts = {}
+        for trigrams in self.trigrams.values():
+            for t in trigrams:
+                counts[t] = counts.get(t, 0) + 1
+
+        self.index = {}
+        for i, trigrams in self.trigrams.items():
+            needed = max(1, math.ceil(self.thresholds[i] * len(trigrams) - 1e-9))
+            for t in sorted(trigrams, key=lambda t: (counts[t], t))[:len(trigrams) - needed + 1]:
+                self.index.setdefault(t, []).append(i)
+
+    # The matcher's tables, as plain lists and dicts. A compiled watchlist stores these rather than the matcher,
+    # since a pickled class is tied to its module, which is __main__ when the script is run directly.
+    TABLES = ['watchlist', 'goto', 'outputs', 'fail', 'always', 'thresholds', 'trigrams', 'short', 'index']
+
+    def to_tables(self):
+        return {name: getattr(self, name) for name in self.TABLES}
+
+    # Rebuild a matcher from to_tables(), returning None if the tables are incomplete
+    @classmethod
+    def from_tables(cls, tables):
+        if not isinstance(tables, dict) or any(name not in tables for name in cls.TABLES):
+            return None
+
+        matcher = cls.__new__(cls)
+        for name in cls.TABLES:
+            setattr(matcher, name, tables[name])
+        return matcher
+
+    # Return the sorted indices of the watchlist entries found in the line
+    def search(self, line):
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+
+        found = set(self.always)
+        node  = 0
+        for ch in line.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if outputs[node]:
+                found.update(outputs[node])
+
+        if self.thresholds:
+            found.update(i for i, score in self.scores(line).items() if score >= self.thresholds[i])
+
+        return sorted(found)
+
+    # Score the line against the fuzzy entries that could match it, as the share of each entry's trigrams found
+    # in it. Returns the scores by entry index.
+    def scores(self, line):
+        text       = normalise_title(line)
+        trigrams   = get_trigrams(text)
+        candidates = set()
+        for t in trigrams:
+            candidates.update(self.index.get(t, ()))
+
+        scores = {i: len(self.trigrams[i] & trigrams) / len(self.trigrams[i]) for i in candidates}
+        scores.update((i, 1.0) for i, short in self.short if short in text)
+        return scores
+
+# Yield the comics matched from the watchlist, in the order they are listed. Each comic is only matched once,
+# even if several sources list it; pass the same seen set to calls matching more of the same release lists.
+@timed('match')
+def match_comics(comics, watchlist, only_once=True, seen=None):
+    matcher = watchlist if isinstance(watchlist, WatchlistMatcher) else WatchlistMatcher(watchlist)
+    seen    = set() if seen is None else seen
+
+    for c in comics:
+        # Skip non-comics, e.g. games and merch
+        if not c.is_comic or not matcher.search(c.line):
+            continue
+
+        # There may be several variants of the same comic being released at the same time, so it is often
+        # redundant to consider all titles that match
+        if only_once:
+            if c.base is None:
+                continue
+            c = c.main_edition()
+
+        key = get_match_key(c.title)
+        if key not in seen:
+            seen.add(key)
+            metrics.count('matches')
+            yield c
+
+# The key under which a matched title is only yielded once: the title normalised around its issue numbers, so that
+# e.g. "Batman 66 #5" and "Batman #665" stay apart
+def get_match_key(title):
+    return '#'.join(normalise_title(part) for part in title.split('#'))
+
+# Build a fuzzy matcher scoring comics against every watchlist entry, down to REPLAY_NEAR_MISS below the entry's
+# threshold. Returns it with the watchlist position of each of its entries; entries with no letters or digits are left out.
+def get_near_miss_matcher(matcher):
+    entries, positions = [], []
+    for i, watched in enumerate(matcher.watchlist):
+        m = FUZZY_ENTRY.fullmatch(watched)
+        threshold, text = (float(m.group(1) or FUZZY_THRESHOLD), m.group(2)) if m else (1.0, watched)
+        if normalise_title(text):
+            entries.append('~{:.2f}:{}'.format(max(0.0, threshold - REPLAY_NEAR_MISS), text))
+            positions.append(i)
+
+    return WatchlistMatcher(entries), positions
+
+# Match replayed comics against the watchlist, finding for each watchlist entry the comics it matches and those
+# it nearly matches. Returns two lists in watchlist order: the titles matched by each entry, and dicts from the
+# titles each entry nearly matches to their scores.
+@timed('match')
+def replay_comics(comics, matcher, only_once=True):
+    near, positions = get_near_miss_matcher(matcher)
+    matched = [OrderedDict() for _ in matcher.watchlist] # Used as ordered sets of titles
+    missed  = [{} for _ in matcher.watchlist]
+
+    for c in comics:
+        if not c.is_comic:
+            continue
+
+        found  = set(matcher.search(c.line))
+        scores = near.scores(c.line)
+        if only_once:
+            if c.base is None:
+                continue
+            c = c.main_edition()
+
+        for i in found:
+            matched[i][c.title] = None
+        for j, score in scores.items():
+            i = positions[j]
+            if i not in found and score >= near.thresholds[j]:
+                missed[i][c.title] = max(score, missed[i].get(c.title, 0))
+
+    return [list(titles) for titles in matched], missed
+
+# Saved matched comics in a csv log file
+@timed('log')
+def save_match_log(matches, log_file):
+    try:
+        # Create directories as needed
+        if not os.path.exists(os.path.dirname(log_file)):
+            os.makedirs(os.path.dirname(log_file))
 
-        with open(behaviour_log_file, write_mode, newline='') as logfile:
+        # Append under a lock, so that runs sharing the log file don't interleave their rows
+        with open(log_file, 'a', newline='') as logfile:
+            lock_file(logfile)
             csvwriter = csv.writer(logfile, quoting=csv.QUOTE_MINIMAL)
-            if write_headers:
+
+            # If the log file hasn't been used before, write the headers
+            if logfile.seek(0, os.SEEK_END) == 0:
                 csvwriter.writerow(['Title','Match Date'])
-            csvwriter.writerows([[comic, date.today().isoformat()] for comic in matches])
+            csvwriter.writerows([comic.title, date.today().isoformat()] for comic in matches)
 
     except (OSError, IOError):
-        print("Failed to write to logfile:", behaviour_log_file + '.', "Ensure you have permissions on the selected path.")
+        print("Failed to write to logfile:", log_file + '.', "Ensure you have permissions on the selected path.")
+
+# Split a comic title into its series name and issue number, e.g. "Saga #12" into ("Saga", 12)
+def split_comic_title(title):
+    m = COMIC_TITLE_ONLY.match(title)
+    if not m:
+        return None, None
+
+    base = m.group()
+    hash = base.rindex('#')
+    return base[:hash].strip(), int(base[hash + 1:])
+
+# Open the match history database, creating it as needed
+def open_history():
+    if not os.path.isdir(DATA_FOLDER):
+        os.makedirs(DATA_FOLDER)
+
+    conn = sqlite3.connect(DATA_FILE_HISTORY, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(HISTORY_SCHEMA)
+
+    return conn
+
+# Import an existing CSV match log into the history, once per log file
+def import_match_log(conn, log_file, tenant=''):
+    path = os.path.abspath(log_file)
+    if not os.path.isfile(path) or conn.execute('SELECT 1 FROM imports WHERE path = ?', (path,)).fetchone():
+        return
+
+    # Stream the rows into the database, so that a long log is never read in whole
+    def read_rows(logfile):
+        for row in csv.reader(logfile):
+            if len(row) < 2 or row == ['Title', 'Match Date']:
+                continue
+            series, issue = split_comic_title(row[0])
+            yield tenant, row[0], series, issue, row[1]
+
+    with open(path, 'r', newline='') as logfile, conn:
+        cursor = conn.executemany('INSERT INTO matches (tenant, title, series, issue, match_date) VALUES (?, ?, ?, ?, ?)',
+            read_rows(logfile))
+        conn.execute('INSERT INTO imports (path, imported) VALUES (?, ?)', (path, date.today().isoformat()))
+
+    if DEBUG != '':
+        print("Imported", cursor.rowcount, "matches from", path, "into the history")
+
+# Record matched comics in the history database, in a single transaction
+@timed('log')
+def save_match_history(matches, log_file, tenant=''):
+    try:
+        conn = open_history()
+        try:
+            import_match_log(conn, log_file, tenant)
+            with conn:
+                cursor = conn.executemany('INSERT INTO matches (tenant, title, series, issue, match_date) VALUES (?, ?, ?, ?, ?)',
+                    ((tenant, c.title, c.base[:c.base.rindex('#')].strip() if c.base else None, c.issue,
+                        date.today().isoformat()) for c in matches))
+            metrics.count('logged', cursor.rowcount)
+        finally:
+            conn.close()
+    except (OSError, IOError, sqlite3.Error) as e:
+        print("Failed to save the match history to", DATA_FILE_HISTORY + ':', e, file=sys.stderr)
+
+# Look up past matches whose title contains the given text, newest first
+def query_match_history(text='', tenant=None, log_file=None):
+    conn = open_history()
+    try:
+        if log_file is not None:
+            import_match_log(conn, log_file)
+
+        sql  = "SELECT tenant, title, match_date FROM matches WHERE title LIKE ? ESCAPE '\\'"
+        args = ['%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%']
+        if tenant is not None:
+            sql  += ' AND tenant = ?'
+            args += [tenant]
+
+        return conn.execute(sql + ' ORDER BY match_date DESC, title', args).fetchall()
+    finally:
+        conn.close()
+
+# Print the matching history, or export it as CSV
+def show_match_history(cli_args):
+    log_file = Settings(read_config()).log_file
+    rows     = query_match_history(cli_args.history, cli_args.history_tenant, log_file)
+
+    if cli_args.history_csv:
+        with open(cli_args.history_csv, 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile, quoting=csv.QUOTE_MINIMAL)
+            csvwriter.writerow(['Title', 'Match Date', 'Tenant'])
+            csvwriter.writerows([[title, match_date, tenant] for tenant, title, match_date in rows])
+        print("Exported", len(rows), "matches to", cli_args.history_csv)
+        return
+
+    for tenant, title, match_date in rows:
+        print(match_date, title + (' (' + tenant + ')' if tenant else ''))
+
+# Print what each watchlist entry matches in the replayed comics, followed by its closest near misses
+def print_replay_report(watchlist, matched, missed):
+    for watched, titles, near in zip(watchlist, matched, missed):
+        print(watched)
+        for title in titles:
+            print('  match', title)
+
+        near = sorted(near.items(), key=lambda ts: (-ts[1], ts[0]))
+        for title, score in near[:REPLAY_MAX_NEAR_MISS]:
+            print('  near ', title, '({:.0%})'.format(score))
+        if len(near) > REPLAY_MAX_NEAR_MISS:
+            print('  ... and', len(near) - REPLAY_MAX_NEAR_MISS, 'more near misses')
+        if not titles and not near:
+            print('  no matches')
+
+# Check the watchlist against the archived feeds instead of the live ones, reporting what each entry matches and
+# nearly matches. Nothing is mailed or saved, so it can be run after every edit of the watchlist.
+def run_replay(cli_args):
+    settings = Settings(read_config())
+    if cli_args.jobs is not None:
+        settings.jobs = cli_args.jobs
+
+    matcher = get_watchlist_matcher()
+    if not matcher.watchlist:
+        err_exit("You have no watched comics. Please place your comics in " + \
+            CONFIG_FILE_WATCHLIST + ". See the README for details.", ERR_NO_WATCHLIST)
+
+    start, end = cli_args.replay
+    archived   = []
+    for source in settings.sources:
+        first, last, entries = get_archived_entries(source, start, end)
+        if entries:
+            print("Replaying", len(entries), source.name, "entries from", first, "to", last)
+            archived.append((source, entries))
+    if not archived:
+        err_exit("No archived feeds to replay" + (" from " + str(start) + " to " + str(end) if start else '') + \
+            ". Feeds are archived in " + DATA_FOLDER_ARCHIVE + " whenever a check fetches them.", ERR_NO_FEED)
+
+    comics          = parse_comic_list(archived, settings)
+    matched, missed = replay_comics(comics, matcher, not cli_args.all_versions)
+    print_replay_report(matcher.watchlist, matched, missed)
+
+    found = {get_match_key(title) for titles in matched for title in titles}
+    print(len(found), "comics matched in", metrics.counters.get('entries', 0), "entries")
+
+# The key under which a comic is remembered as notified: its normalised series and issue number, so that
+# variants, reprints and the same issue turning up in a later week are all recognised
+def get_notified_key(comic):
+    name = comic.base[:comic.base.rindex('#')] if comic.base else comic.title
+    key  = normalise_title(name)
+    return key if comic.issue is None else key + '#' + str(comic.issue)
+
+# Drop the comics that have already been notified to a tenant, forgetting notifications older than the expiry.
+# The comics are checked a batch at a time as they are matched. Expired notifications are ignored, and purged
+# unless nothing is to be saved.
+def filter_notified(matches, expiry, tenant=''):
+    if expiry <= 0:
+        yield from matches
+        return
+
+    conn   = None
+    cutoff = (date.today() - timedelta(days=expiry)).isoformat()
+    try:
+        conn = open_history()
+        if DEBUG_NOSAVE not in DEBUG:
+            with conn:
+                conn.execute('DELETE FROM notified WHERE notified_date < ?', (cutoff,))
+    except (OSError, IOError, sqlite3.Error) as e:
+        print("Failed to check previous notifications in", DATA_FILE_HISTORY + ':', e, file=sys.stderr)
+
+    skipped = 0
+    try:
+        for batch in batched(matches, NOTIFIED_BATCH_SIZE):
+            keys     = list({get_notified_key(c) for c in batch})
+            notified = set()
+            if conn is not None:
+                try:
+                    sql      = 'SELECT key FROM notified WHERE tenant = ? AND notified_date >= ? AND key IN (' + \
+                        ','.join('?' * len(keys)) + ')'
+                    notified = {row[0] for row in conn.execute(sql, [tenant, cutoff] + keys)}
+                except sqlite3.Error as e:
+                    print("Failed to check previous notifications in", DATA_FILE_HISTORY + ':', e, file=sys.stderr)
+
+            skipped += len(notified)
+            for c in batch:
+                if get_notified_key(c) not in notified:
+                    yield c
+    finally:
+        if conn is not None:
+            conn.close()
+
+    if DEBUG != '' and skipped:
+        print("Skipping", skipped, "issues already notified")
+
+# Remember the comics that have been notified to a tenant
+def save_notified(matches, expiry, tenant=''):
+    if expiry <= 0 or DEBUG_NOSAVE in DEBUG:
+        return
+
+    try:
+        conn = open_history()
+        try:
+            with conn:
+                today = date.today().isoformat()
+                conn.executemany('INSERT OR REPLACE INTO notified (tenant, key, notified_date) VALUES (?, ?, ?)',
+                    [(tenant, key, today) for key in {get_notified_key(c) for c in matches}])
+        finally:
+            conn.close()
+    except (OSError, IOError, sqlite3.Error) as e:
+        print("Failed to save the notified comics to", DATA_FILE_HISTORY + ". They might be mailed again:", e, file=sys.stderr)
 
 # Get the text to display to the user when setting up params
 def get_setup_text():
@@ -301,7 +2116,10 @@ def get_setup_text():
     d[CONFIG_SECTION_MAILGUN + '/' + CONFIG_KEY_MAILGUN_TO]     = 'Enter your recipient email address'
 
     d[CONFIG_SECTION_BEHAVIOUR + '/' + CONFIG_KEY_BEHAVIOUR_MAIL_ON_ERROR] = 'Do you want to receive emails when an error is encountered? (yes/no)'
-    d[CONFIG_SECTION_BEHAVIOUR + '/' + CONFIG_KEY_BEHAVIOUR_LOG_FILE]      = 'Log file (used only when running with --log)'
+    d[CONFIG_SECTION_BEHAVIOUR + '/' + CONFIG_KEY_BEHAVIOUR_LOG_FILE]      = 'CSV log file (imported into the match history, and used only when running with --log)'
+    d[CONFIG_SECTION_BEHAVIOUR + '/' + CONFIG_KEY_BEHAVIOUR_LOG_CSV]       = 'Do you want to keep writing matches to the CSV log file as well as the history? (yes/no)'
+    d[CONFIG_SECTION_BEHAVIOUR + '/' + CONFIG_KEY_BEHAVIOUR_FEED_MAX_AGE]  = 'Maximum age in days of the cached feed used when the live feed is down'
+    d[CONFIG_SECTION_BEHAVIOUR + '/' + CONFIG_KEY_BEHAVIOUR_NOTIFIED_EXPIRY] = 'For how many days should an issue you were notified about not be mailed again? (0 to always mail)'
 
     return d
 
@@ -330,7 +2148,8 @@ def run_setup():
     params = []
     for k in [CONFIG_KEY_MAILGUN_KEY, CONFIG_KEY_MAILGUN_DOMAIN, CONFIG_KEY_MAILGUN_FROM, CONFIG_KEY_MAILGUN_TO]:
         params += [CONFIG_SECTION_MAILGUN + '/' + k]
-    for k in [CONFIG_KEY_BEHAVIOUR_MAIL_ON_ERROR, CONFIG_KEY_BEHAVIOUR_LOG_FILE]:
+    for k in [CONFIG_KEY_BEHAVIOUR_MAIL_ON_ERROR, CONFIG_KEY_BEHAVIOUR_LOG_FILE, CONFIG_KEY_BEHAVIOUR_LOG_CSV, CONFIG_KEY_BEHAVIOUR_FEED_MAX_AGE, \
+            CONFIG_KEY_BEHAVIOUR_NOTIFIED_EXPIRY]:
         params += [CONFIG_SECTION_BEHAVIOUR + '/' + k]
 
     # If a config file already exists, back it up first
@@ -353,20 +2172,117 @@ def run_setup():
     else:
         if not os.path.isdir(CONFIG_FOLDER):
             os.makedirs(CONFIG_FOLDER)
-        with open(CONFIG_FILE_PARAMS, 'w') as configfile:
+        with atomic_write(CONFIG_FILE_PARAMS) as configfile:
             config.write(configfile)
 
+# Parse the --replay dates, FROM[:TO] as YYYY-MM-DD. A single date replays the week starting on it.
+def parse_replay_range(text):
+    try:
+        dates = [datetime.strptime(d, '%Y-%m-%d').date() for d in text.split(':', 1)]
+    except ValueError:
+        raise ArgumentTypeError("expected FROM[:TO] as YYYY-MM-DD dates, not '" + text + "'")
+
+    start, end = dates[0], dates[-1] if len(dates) > 1 else dates[0] + timedelta(days=6)
+    if start > end:
+        raise ArgumentTypeError("the replay starts after it ends: '" + text + "'")
+    return start, end
+
 def parse_cli_args():
     parser = ArgumentParser(description="Send email notifications if new watched comics are available.")
 
-    parser.add_argument('--clean', '-c', action='store_true', help='Ignore last updates and perform a clean run. May result in receiving notification about comics seen previously.')
+    parser.add_argument('--clean', '-c', action='store_true', help='Ignore last updates and perform a clean run. Issues you have already been notified about are still skipped, unless notified_expiry is 0 in the config file.')
     parser.add_argument('--all-versions', '-a', action='store_true', help='Show all versions of a comic, for example variant covers. Without this option, only the main title is shown.')
-    parser.add_argument('--log', '-l', action='store_true', help='Store all comic matches in a log file. The file location can be set in the config file.')
+    parser.add_argument('--log', '-l', action='store_true', help='Store all comic matches in the history database, and in the CSV log file unless log_csv is false in the config file.')
     parser.add_argument('--dry-run', '-d', action='store_true', help='Run the script as normal, but do not send an email result and do not record the last update. Useful for quick checking that everything works.')
     parser.add_argument('--setup', action='store_true', help='Run an interactive setup to configure the user parameters.')
+    parser.add_argument('--history', nargs='?', const='', metavar='TEXT', help='Show the past matches whose title contains TEXT (or all of them) and exit.')
+    parser.add_argument('--history-tenant', metavar='NAME', help='With --history, only show the matches of the given tenant. Use "" for your own matches.')
+    parser.add_argument('--history-csv', metavar='FILE', help='With --history, export the matches to a CSV file instead of showing them.')
+    parser.add_argument('--daemon', action='store_true', help='Keep running and check for new comics on the schedule in the CRON environment variable (by default "' + DAEMON_DEFAULT_CRON + '"), checking again until the new list is out.')
+    parser.add_argument('--profile', nargs='?', const=DATA_FILE_PROFILE, metavar='FILE', help='Profile the run with cProfile and save the stats to FILE (by default ' + DATA_FILE_PROFILE + ').')
+    parser.add_argument('--jobs', '-j', type=int, metavar='N', help='Parse feed entries using up to N processes. Only used when many entries need parsing, e.g. on a clean run. Overrides the config file.')
+    parser.add_argument('--replay', nargs='?', const=(None, None), type=parse_replay_range, metavar='FROM[:TO]', help='Match the watchlist against the feeds archived by previous checks instead of the live ones, and show what each entry matches and nearly matches, without mailing or saving anything. Replays the weeks from FROM to TO (YYYY-MM-DD), the week starting on FROM, or by default the latest week.')
+    parser.add_argument('--tenants', '-t', metavar='DIR', help='Check the watchlists of all the tenant configs (*.cfg) in DIR, fetching the feed only once. Each tenant needs a [mailgun] recipient and a [behaviour] watchlist, and may set its own log file.')
 
     return parser.parse_args()
 
+# Check every tenant against a single fetch and parse of the feed
+def run_tenants(cli_args, settings):
+    tenants = read_tenants(cli_args.tenants, settings.log_csv)
+    if not tenants:
+        err_exit("No valid tenant configs found in " + cli_args.tenants + ".", ERR_NO_CONFIG)
+
+    # Each tenant keeps its own last update, so fetch everything newer than the oldest of them
+    last_updates = {t.name: None if cli_args.clean else get_last_update(t.last_update_file) for t in tenants}
+    since        = None if None in last_updates.values() else min(last_updates.values())
+    updates      = get_rss_entries(settings.sources, since, settings.feed_max_age)
+    if DEBUG != '':
+        print(len(tenants), "tenants")
+
+    # Each tenant collects its matches, and the comics it has already matched so that they are only mailed once
+    checked = []
+    for t in tenants:
+        if not os.path.isfile(t.watchlist):
+            print("Skipping tenant", t.name + ": no watchlist at", t.watchlist, file=sys.stderr)
+            continue
+        matcher = get_watchlist_matcher(t.watchlist)
+        if not matcher.watchlist:
+            print("Skipping tenant", t.name + ": the watchlist at", t.watchlist, "is empty", file=sys.stderr)
+            continue
+        checked.append((t, matcher, last_updates[t.name], set(), []))
+
+    # Parse each entry once, matching it for every tenant it is new to before moving on to the next one
+    keep_title_only = not cli_args.all_versions
+    dates           = set()
+    for d, comics in parse_sources(updates, settings):
+        dates.add(d)
+        for t, matcher, since, seen, matched in checked:
+            if since is None or d > since:
+                matched.extend(match_comics(comics, matcher, keep_title_only, seen))
+
+    # Finish every tenant first, so that all the update mails can be sent together
+    results = []
+    for t, _, _, _, matched in checked:
+        matched = list(filter_notified(matched, settings.notified_expiry, t.name))
+        if len(matched) == 0 and DEBUG != '':
+            print("No newer comics available for tenant", t.name + ".")
+        results.append((t, matched))
+
+    entries = metrics.counters.get('entries', 0)
+    if DEBUG != '':
+        print(entries, "feed entries")
+
+    # Once the mails are safely queued, the tenants' state can be saved
+    send_mail_updates([(t.to, matched) for t, matched in results if matched])
+
+    save_update = may_save_last_update(len(dates) > 0)
+    for t, matched in results:
+        if matched:
+            save_notified(matched, settings.notified_expiry, t.name)
+            if cli_args.log:
+                save_match_history(matched, t.log_file, t.name)
+                if t.log_csv:
+                    save_match_log(matched, t.log_file)
+
+        # Only a tenant that some of the entries were new to has checked a newer list
+        since = last_updates[t.name]
+        if save_update and any(since is None or d > since for d in dates):
+            save_last_update(t.last_update_file)
+
+    drain_outbox(settings)
+
+    return entries
+
+# Save the stats of a profiled run, without hiding the error the run may have stopped on
+def save_profile(profiler, path):
+    try:
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        profiler.dump_stats(path)
+        print("Profile saved to", path)
+    except (OSError, IOError) as e:
+        print("Failed to save the profile to", path + ':', e, file=sys.stderr)
+
 def main():
     cli_args = parse_cli_args()
 
@@ -374,36 +2290,63 @@ def main():
     if cli_args.setup:
         run_setup()
         sys.exit(0)
+    elif cli_args.history is not None:
+        show_match_history(cli_args)
+        sys.exit(0)
+    elif cli_args.replay is not None:
+        run_replay(cli_args)
+        sys.exit(0)
     elif cli_args.dry_run:
         global DEBUG
         DEBUG += '|'.join(['', DEBUG_NOMAIL, DEBUG_NOSAVE])
 
-    # Read the Mailgun config parameters
-    global mailgun_key, mailgun_domain, mailgun_from, mailgun_to
-    mailgun_key, mailgun_domain, mailgun_from, mailgun_to = read_mailgun_params()
-    paramlist = [mailgun_key, mailgun_domain, mailgun_from, mailgun_to]
-    if None in paramlist:
-        err_exit("Invailid Mailgun configuration. Please check the config file at " + \
-                CONFIG_FILE_PARAMS + " and see the README for details.", ERR_INVALID_PARAMS)
-
-    if DEBUG_PARAMS in DEBUG:
-        print("Params:", paramlist)
+    if cli_args.daemon:
+        run_daemon(cli_args)
+        return
 
-    # Read the behaviour config paramters
-    global behaviour_mail_on_error, behaviour_log_file
-    behaviour_mail_on_error, behaviour_log_file = read_behaviour_params()
+    # Profile the check if requested, and always report how it went
+    profiler = None
+    if cli_args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    if DEBUG_PARAMS in DEBUG:
-        print("Mail on error:", behaviour_mail_on_error)
-        print("Log path:", behaviour_log_file)
+    settings = None
+    skipped  = False
+    try:
+        settings = load_settings(cli_args)
+        with run_lock(settings) as locked:
+            if locked:
+                run_check(cli_args, settings)
+            skipped = not locked
+    except CheckError as e:
+        metrics.exit_code = e.code
+        report_error(settings, e)
+        raise
+    except SystemExit as e:
+        metrics.exit_code = e.code
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            save_profile(profiler, cli_args.profile)
+
+        # A skipped run leaves the report of the check that is running
+        if not skipped:
+            metrics.save()
+
+# Check for new comics, using the configured parameters. Returns the number of new feed entries.
+def run_check(cli_args, settings):
+    if cli_args.tenants:
+        return run_tenants(cli_args, settings)
 
     # Read the watchlist
-    watchlist = read_watchlist()
-    if not watchlist:
+    matcher = get_watchlist_matcher()
+    if not matcher.watchlist:
         err_exit("You have no watched comics. Please place your comics in " + \
             CONFIG_FILE_WATCHLIST + ". See the README for details.", ERR_NO_WATCHLIST)
     if DEBUG_WATCHLIST in DEBUG:
-        print("Watchlist:", watchlist)
+        print("Watchlist:", matcher.watchlist)
 
     # Read the last update date
     last_update = get_last_update()
@@ -413,24 +2356,160 @@ def main():
     if cli_args.clean:
         last_update = None
         print("Ignoring last update")
-    updates = get_rss_entries(last_update)
-    if DEBUG != '':
-        print(len(updates), "feed entries")
+    updates = get_rss_entries(settings.sources, last_update, settings.feed_max_age)
 
+    # Stream the comics from the feed entries to the matches, only holding on to the comics to mail
     keep_title_only = not cli_args.all_versions
-    comics          = parse_comic_list(updates)
-    matched         = match_comics(comics, watchlist, keep_title_only)
+    comics          = parse_comic_list(updates, settings)
+    matched         = list(filter_notified(match_comics(comics, matcher, keep_title_only), settings.notified_expiry))
+    entries         = metrics.counters.get('entries', 0)
+    if DEBUG != '':
+        print(entries, "feed entries")
+
     if len(matched) > 0:
-        send_mail_update(matched)
+        send_mail_update(matched, settings.mailgun_to)
+        save_notified(matched, settings.notified_expiry)
         if cli_args.log:
-            save_match_log(matched)
+            save_match_history(matched, settings.log_file)
+            if settings.log_csv:
+                save_match_log(matched, settings.log_file)
     else:
         print("No newer comics available.")
 
-    # Save the date of the last update
-    if not DEBUG_NOSAVE in DEBUG:
+    # Save the date of the last update, now that any update mail is safely queued
+    if may_save_last_update(entries > 0):
         save_last_update()
 
+    drain_outbox(settings)
+
+    return entries
+
+# A cron schedule, e.g. "0 18 * * 3", with support for *, lists, ranges, steps and month and day names
+class CronSchedule:
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)] # Minute, hour, day of month, month, day of week
+    NAMES  = [{}, {}, {},
+        {m: i + 1 for i, m in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])},
+        {d: i for i, d in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])}]
+
+    def __init__(self, expr):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError("expected 5 fields in '" + expr + "'")
+
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, self.weekdays = \
+            [self.parse_field(f, lo, hi, names) for f, (lo, hi), names in zip(fields, self.FIELDS, self.NAMES)]
+        self.weekdays = {d % 7 for d in self.weekdays} # Both 0 and 7 are Sunday
+
+        # As in cron, when both days are restricted a day matching either of them will do
+        self.any_day     = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    # Parse a field into the set of values it allows
+    @staticmethod
+    def parse_field(field, lo, hi, names):
+        values = set()
+        for part in field.lower().split(','):
+            part, _, step = part.partition('/')
+            if part == '*':
+                start, end = lo, hi
+            else:
+                start, _, end = part.partition('-')
+                start = names.get(start, start)
+                end   = names.get(end, end) if end else (hi if step else start)
+            start, end, step = int(start), int(end), int(step or 1)
+            if not lo <= start <= end <= hi or step < 1:
+                raise ValueError("invalid field '" + field + "'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches_day(self, d):
+        in_month   = d.day in self.days
+        in_weekday = (d.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_weekday
+        return in_month or in_weekday
+
+    # The first time after the given datetime that the schedule fires
+    def next_after(self, after):
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day   = start.date()
+        for _ in range(366 * 8): # Long enough for any valid schedule, including the 29th of February
+            if day.month in self.months and self.matches_day(day):
+                for h in sorted(self.hours):
+                    for m in sorted(self.minutes):
+                        t = datetime(day.year, day.month, day.day, h, m)
+                        if t >= start:
+                            return t
+            day += timedelta(days=1)
+
+        raise ValueError("'" + self.expr + "' never fires")
+
+# Run a single check for the daemon, keeping it alive whatever happens. Returns whether new entries were found,
+# and the settings to pass to the next check, which are only read again when the config file changes.
+def run_daemon_check(cli_args, settings=None):
+    global metrics
+    metrics = RunMetrics()
+    print("Checking for new comics at", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    sys.stdout.flush()
+
+    skipped = False
+    try:
+        settings = load_settings(cli_args, settings)
+        with run_lock(settings) as locked:
+            if locked:
+                return run_check(cli_args, settings) > 0, settings
+            skipped = True
+    except CheckError as e:
+        metrics.exit_code = e.code
+        report_error(settings, e)
+    except SystemExit as e:
+        metrics.exit_code = e.code
+    except Exception:
+        metrics.exit_code = 1
+        traceback.print_exc()
+    finally:
+        if not skipped:
+            metrics.save()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    return False, settings
+
+# Stay running and check for new comics on the CRON schedule. Around release time, keep checking with a
+# jittered backoff until the new list is out. Stops cleanly on SIGTERM or SIGINT.
+def run_daemon(cli_args):
+    expr = os.environ.get('CRON', DAEMON_DEFAULT_CRON)
+    try:
+        schedule = CronSchedule(expr)
+    except ValueError as e:
+        err_exit("Invalid CRON schedule: " + str(e), ERR_INVALID_PARAMS)
+
+    stop     = threading.Event()
+    settings = None
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    while not stop.is_set():
+        fire = schedule.next_after(datetime.now())
+        print("Next check at", fire.isoformat(' '), "(" + expr + ")")
+        sys.stdout.flush()
+        if stop.wait(max(0, (fire - datetime.now()).total_seconds())):
+            break
+
+        attempt, give_up = 0, time.time() + DAEMON_POLL_WINDOW
+        found, settings = run_daemon_check(cli_args, settings)
+        while not found and time.time() < give_up:
+            delay    = min(DAEMON_POLL_DELAY * 2 ** attempt, DAEMON_POLL_MAX_DELAY) * random.uniform(0.5, 1.5)
+            attempt += 1
+            print("No new comics list yet, checking again in", round(delay / 60), "minutes")
+            sys.stdout.flush()
+            if stop.wait(delay):
+                break
+            found, settings = run_daemon_check(cli_args, settings)
+
+    print("Stopping")
+
 if __name__ == '__main__':
     main()
 
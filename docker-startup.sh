@@ -7,13 +7,10 @@ chown -R comics:comics /home/comics/.config /home/comics/.local
 if [ "$1" = 'setup' -o "$1" = '--setup' ]; then
     su -c '/comics-mailer/code/comics_mailer.py --setup' comics
 elif [ "$1" = 'run' ]; then
-    # Set up the cronjob and run the cron daemon by default
+    # Run the application as a daemon on the $CRON schedule by default. It replaces this shell, so that it
+    # receives the container's SIGTERM and can shut down cleanly.
     logf='/comics-mailer/data/last_run.log'
-    echo "$CRON date > $logf; /comics-mailer/code/comics_mailer.py >> $logf" | crontab -u comics -
-    crond
-
-    # Keep the container running
-    tail -f /dev/null
+    exec su -c "CRON='$CRON' exec /comics-mailer/code/comics_mailer.py --daemon >> $logf 2>&1" comics
 else
     # Handle custom commands otherwise
     exec "$@"
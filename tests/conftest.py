@@ -0,0 +1,74 @@
+import os
+import sys
+import inspect
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+# The script is a single module at the root of the repo, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import comics_mailer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures')
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+# A quiet request handler, answering every GET and POST with respond(handler), which sends the response
+class StandIn(BaseHTTPRequestHandler):
+    respond = None
+
+    def do_GET(self):
+        type(self).respond(self)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+# Start local HTTP servers for the duration of a test. Call it with a function taking the request handler and
+# sending the response; it returns the server's base URL.
+@pytest.fixture
+def http_server():
+    servers = []
+
+    def start(respond):
+        handler = type('Handler', (StandIn,), {'respond': staticmethod(respond)})
+        server  = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:' + str(server.server_port)
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+# Keep the config and data files of a test in its own temporary folder, including the ones functions take as
+# default arguments
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    folders = {comics_mailer.CONFIG_FOLDER: str(tmp_path / 'config'), comics_mailer.DATA_FOLDER: str(tmp_path / 'data')}
+    paths   = {}
+    for name in dir(comics_mailer):
+        value = getattr(comics_mailer, name)
+        if not name.startswith(('CONFIG_', 'DATA_')) or not isinstance(value, str):
+            continue
+        for folder, moved in folders.items():
+            if value.startswith(folder):
+                paths[value] = moved + value[len(folder):]
+                monkeypatch.setattr(comics_mailer, name, paths[value])
+
+    for f in vars(comics_mailer).values():
+        f = getattr(f, '__wrapped__', f)
+        if inspect.isfunction(f) and f.__module__ == comics_mailer.__name__ and f.__defaults__:
+            monkeypatch.setattr(f, '__defaults__', tuple(paths.get(d, d) if isinstance(d, str) else d for d in f.__defaults__))
+
+    monkeypatch.setattr(comics_mailer, 'http_sessions', {})
+    monkeypatch.setattr(comics_mailer, 'watchlist_cache', {})
+    monkeypatch.setattr(comics_mailer, 'metrics', comics_mailer.RunMetrics())
+    return tmp_path
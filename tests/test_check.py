@@ -0,0 +1,100 @@
+import os
+from argparse import Namespace
+from configparser import ConfigParser
+from datetime import date, timedelta
+
+import pytest
+
+import comics_mailer
+
+# A weekly ComicList entry releasing a single comic
+ITEM = """<item>
+  <title>ComicList: New Comic Book Releases List for {when:%m/%d/%Y}</title>
+  <guid isPermaLink="false">http://www.comiclist.com/index.php/newreleases/{when:%Y-%m-%d}</guid>
+  <description><![CDATA[<p>logo</p><p>intro</p><p>note</p><p>csv</p><p>{when:%m/%d/%Y},IMAGE COMICS,{title},$3.99</p>]]></description>
+</item>"""
+
+def make_feed(releases):
+    items = ''.join(ITEM.format(when=when, title=title) for when, title in releases)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel><title>ComicList</title>' + items + \
+        '</channel></rss>').encode('utf-8')
+
+# A feed server serving whatever releases are currently listed
+class ReleaseServer:
+
+    def __init__(self, http_server):
+        self.releases = []
+        self.url      = http_server(self.respond) + '/feed'
+
+    def respond(self, handler):
+        body = make_feed(self.releases)
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/rss+xml')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+@pytest.fixture
+def check(home, http_server, monkeypatch):
+    server = ReleaseServer(http_server)
+
+    config = ConfigParser()
+    config.read_dict({
+        comics_mailer.CONFIG_SECTION_MAILGUN: {comics_mailer.CONFIG_KEY_MAILGUN_TO: 'reader@example.com'},
+        comics_mailer.CONFIG_SECTION_SOURCE + comics_mailer.SOURCE_COMICLIST: {comics_mailer.CONFIG_KEY_SOURCE_URL: server.url},
+    })
+    settings = comics_mailer.Settings(config)
+    cli_args = Namespace(tenants=None, clean=False, all_versions=False, log=False, jobs=None)
+
+    os.makedirs(os.path.dirname(comics_mailer.CONFIG_FILE_WATCHLIST))
+    with open(comics_mailer.CONFIG_FILE_WATCHLIST, 'w') as f:
+        f.write('Saga\n')
+    monkeypatch.setattr(comics_mailer, 'DEBUG', '|' + comics_mailer.DEBUG_NOMAIL)
+
+    def run(releases, tenants=None):
+        server.releases = releases
+        monkeypatch.setattr(comics_mailer, 'metrics', comics_mailer.RunMetrics())
+        cli_args.tenants = tenants
+        return comics_mailer.run_check(cli_args, settings)
+
+    return run
+
+def write_last_update(path, when):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(when.isoformat())
+
+def test_list_published_later_on_release_day_is_found(check):
+    today, last_week = date.today(), date.today() - timedelta(days=7)
+    write_last_update(comics_mailer.DATA_FILE_LAST_UPDATE, last_week)
+
+    # The daemon checks on release day before the new list is out, then again once it is
+    assert check([(last_week, 'Saga #1')]) == 0
+    assert comics_mailer.get_last_update() == last_week
+
+    assert check([(last_week, 'Saga #1'), (today, 'Saga #2')]) == 1
+    assert comics_mailer.get_last_update() == today
+
+    assert check([(last_week, 'Saga #1'), (today, 'Saga #2')]) == 0
+
+def test_tenants_only_move_on_once_they_find_new_entries(check, home):
+    today, last_week, earlier = date.today(), date.today() - timedelta(days=7), date.today() - timedelta(days=14)
+
+    folder = home / 'tenants'
+    folder.mkdir()
+    (folder / 'watchlist.txt').write_text('Saga\n')
+    for name, checked in [('ahead', last_week), ('behind', earlier)]:
+        (folder / (name + comics_mailer.CONFIG_EXT_TENANT)).write_text('[mailgun]\nto = ' + name + '@example.com\n' + \
+            '[behaviour]\nwatchlist = watchlist.txt\n')
+        write_last_update(os.path.join(comics_mailer.DATA_FOLDER_TENANTS, name, 'last_update'), checked)
+
+    def last_updates():
+        return [comics_mailer.get_last_update(os.path.join(comics_mailer.DATA_FOLDER_TENANTS, name, 'last_update'))
+            for name in ('ahead', 'behind')]
+
+    # Last week's list is only new to the tenant that hasn't checked it yet
+    assert check([(last_week, 'Saga #1')], str(folder)) == 1
+    assert last_updates() == [last_week, today]
+
+    assert check([(last_week, 'Saga #1'), (today, 'Saga #2')], str(folder)) == 1
+    assert last_updates() == [today, today]
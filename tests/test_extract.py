@@ -0,0 +1,72 @@
+import os
+
+import feedparser
+import pytest
+
+import comics_mailer
+from conftest import FIXTURES
+
+pytest.importorskip('bs4')
+
+def fixture_summaries():
+    with open(os.path.join(FIXTURES, 'comiclist.xml'), 'rb') as f:
+        feed = comics_mailer.parse_feed(f.read())
+    return [e.summary for e in feed.entries]
+
+# Summaries the recorded feed does not cover: paragraphs nested in others, paragraphs left open, stray end tags
+# and the wanted paragraph missing
+EDGE_CASES = [
+    '<p>a</p><p>b</p><p>c</p><p>d</p><p>1,X,Saga #1,$3.99<br />2,Y,Hellboy #2,$3.99</p>',
+    '<p>a<p>b<p>c<p>d<p>1,X,Saga #1,$3.99<br />2,Y,Hellboy #2,$3.99',
+    '<p>a</p><p>b</p><p>c</p><p>d</p><p>Saga #1<p>nested</p> after</p> outside',
+    '<p>a</p><p>b<div><p>c</p></div></p><p>d</p><p><b>Saga</b> #1</p></b>',
+    '<p>a</p><p>b</p><p>c</p><p>d</p><p><span>Saga #1</p>still open</span>',
+    '<p>a</p><p>b</p><p>c</p><p>d</p><p>Saga &amp; Co #1</i><br>Hellboy #2<img src="x"></p>',
+    '<div><p>a</p><p>b</div><p>c</p><p>d</p><p>Saga #1',
+]
+
+def extract_with_both(summary):
+    results = []
+    for parser in (comics_mailer.PARSER_STREAM, comics_mailer.PARSER_BS4):
+        try:
+            results.append(comics_mailer.extract_comics(summary, parser))
+        except IndexError:
+            results.append(IndexError)
+    return results
+
+def test_fixture_entries_agree():
+    summaries = fixture_summaries()
+    assert summaries
+
+    for summary in summaries:
+        stream, bs4 = extract_with_both(summary)
+        assert stream == bs4
+        assert stream
+
+@pytest.mark.parametrize('summary', EDGE_CASES)
+def test_edge_cases_agree(summary):
+    stream, bs4 = extract_with_both(summary)
+    assert stream == bs4
+
+def test_missing_paragraph_raises():
+    assert extract_with_both('<p>a</p><p>b</p>') == [IndexError, IndexError]
+
+def test_parallel_parsing_starts_the_processes_once(home, monkeypatch):
+    import concurrent.futures
+
+    started = []
+    class CountedPool(concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            started.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', CountedPool)
+    monkeypatch.setattr(comics_mailer.os, 'cpu_count', lambda: 2)
+    monkeypatch.setattr(comics_mailer, 'PARSE_BATCH_SIZE', 8)
+
+    summaries = fixture_summaries() * 10
+    entries   = [feedparser.FeedParserDict(id=str(i), summary=summary) for i, summary in enumerate(summaries)]
+    parsed    = list(comics_mailer.parse_entries(entries, jobs=2))
+
+    assert [comics for _, comics in parsed] == [comics_mailer.extract_comics(summary) for summary in summaries]
+    assert len(started) == 1
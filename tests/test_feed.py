@@ -0,0 +1,133 @@
+import os
+import json
+import time
+from datetime import date
+
+import pytest
+
+import comics_mailer
+from conftest import FIXTURES
+
+with open(os.path.join(FIXTURES, 'comiclist.xml'), 'rb') as f:
+    FEED = f.read()
+
+ETAG = '"comiclist-1"'
+
+# A feed server answering conditional requests, or failing while down. Records the headers of each request.
+class FeedServer:
+
+    def __init__(self, http_server):
+        self.down     = False
+        self.requests = []
+        self.etag     = ETAG
+        self.url      = http_server(self.respond) + '/feed'
+
+    def respond(self, handler):
+        self.requests.append(dict(handler.headers))
+        if self.down:
+            handler.send_response(500)
+            handler.end_headers()
+        elif handler.headers.get('If-None-Match') == self.etag:
+            handler.send_response(304)
+            handler.end_headers()
+        else:
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'application/rss+xml')
+            handler.send_header('ETag', self.etag)
+            handler.send_header('Content-Length', str(len(FEED)))
+            handler.end_headers()
+            handler.wfile.write(FEED)
+
+@pytest.fixture
+def server(http_server):
+    return FeedServer(http_server)
+
+@pytest.fixture
+def source(home, server):
+    return comics_mailer.Source(comics_mailer.SOURCE_COMICLIST, server.url, comics_mailer.EXTRACTOR_COMICLIST, 5, '',
+        comics_mailer.DATA_FILE_FEED_CACHE, comics_mailer.DATA_FILE_FEED_META)
+
+def titles(entries):
+    return [e.title for e in entries]
+
+def test_fetches_then_revalidates(server, source):
+    first = titles(comics_mailer.get_source_entries(source, None, 7))
+    assert len(first) == 3
+    assert os.path.isfile(source.cache_file)
+
+    # The second fetch sends the cached validator, and the server's 304 is answered from the cache
+    second = titles(comics_mailer.get_source_entries(source, None, 7))
+    assert server.requests[-1].get('If-None-Match') == ETAG
+    assert second == first
+
+def test_not_modified_skips_parsing(server, source, monkeypatch):
+    comics_mailer.get_source_entries(source, None, 7)
+
+    def parse_feed(*args, **kwargs):
+        raise AssertionError('the unchanged feed was parsed again')
+    monkeypatch.setattr(comics_mailer, 'parse_feed', parse_feed)
+
+    # The cached copy was fetched today, so a check since today has nothing to parse or match
+    fetched = comics_mailer.get_rss_entries([source], date.today(), 7)
+    assert [(s, list(entries)) for s, entries in fetched] == [(source, [])]
+    assert len(server.requests) == 2
+
+def test_falls_back_to_recent_cache(server, source):
+    expected = titles(comics_mailer.get_source_entries(source, None, 7))
+
+    server.down = True
+    fetched     = comics_mailer.get_rss_entries([source], None, 7)
+    assert [(s, titles(entries)) for s, entries in fetched] == [(source, expected)]
+
+    # The cached copy may be days old, so the releases listed since must be checked again on the next run
+    assert comics_mailer.metrics.counters['cached_feeds'] == 1
+    assert not comics_mailer.may_save_last_update(True)
+
+def test_live_feed_saves_the_last_update(server, source):
+    comics_mailer.get_rss_entries([source], None, 7)
+    assert comics_mailer.may_save_last_update(True)
+
+def test_skipped_source_keeps_the_last_update(http_server, server, source, home):
+    down      = FeedServer(http_server)
+    down.down = True
+    other     = source._replace(name='other', url=down.url, cache_file=str(home / 'other.xml'), meta_file=str(home / 'other.json'))
+
+    # The other source's releases would be lost if the check moved the shared last update past them
+    fetched = comics_mailer.get_rss_entries([source, other], None, 7)
+    assert [s for s, _ in fetched] == [source]
+    assert comics_mailer.metrics.counters['failed_feeds'] == 1
+    assert not comics_mailer.may_save_last_update(True)
+
+def test_fails_once_cache_is_too_old(server, source):
+    comics_mailer.get_source_entries(source, None, 7)
+
+    with open(source.meta_file, 'r') as f:
+        meta = json.load(f)
+    meta['checked'] = time.time() - 8 * 24 * 60 * 60
+    with open(source.meta_file, 'w') as f:
+        json.dump(meta, f)
+
+    server.down = True
+    with pytest.raises(comics_mailer.CheckError) as e:
+        comics_mailer.get_rss_entries([source], None, 7)
+    assert e.value.code == comics_mailer.ERR_NO_FEED
+
+def test_slow_fetch_leaves_the_cache_alone(server, source, monkeypatch):
+    expected = titles(comics_mailer.get_source_entries(source, None, 7))
+
+    # The check gives up on the feed while it is being parsed, and uses the cache. When the fetch finishes later,
+    # it must not replace the cache, or the next check would take the copy it never matched as already checked.
+    parse_feed = comics_mailer.parse_feed
+    def slow_parse_feed(*args, **kwargs):
+        time.sleep(1)
+        return parse_feed(*args, **kwargs)
+    monkeypatch.setattr(comics_mailer, 'parse_feed', slow_parse_feed)
+
+    server.etag = '"comiclist-2"'
+    source      = source._replace(timeout=0.5)
+    fetched     = comics_mailer.get_rss_entries([source], None, 7)
+    assert [(s, titles(entries)) for s, entries in fetched] == [(source, expected)]
+
+    time.sleep(1)
+    with open(source.meta_file, 'r') as f:
+        assert json.load(f)['etag'] == ETAG
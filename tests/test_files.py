@@ -0,0 +1,47 @@
+import os
+import json
+
+import pytest
+
+import comics_mailer
+from conftest import FIXTURES
+
+with open(os.path.join(FIXTURES, 'comiclist.xml'), 'rb') as f:
+    FEED = f.read()
+
+def test_atomic_write_keeps_the_old_file_on_error(tmp_path):
+    path = str(tmp_path / 'file.json')
+    with comics_mailer.atomic_write(path, fsync=True) as f:
+        f.write('old')
+
+    with pytest.raises(ValueError):
+        with comics_mailer.atomic_write(path) as f:
+            f.write('new')
+            raise ValueError()
+
+    with open(path) as f:
+        assert f.read() == 'old'
+    assert os.listdir(str(tmp_path)) == ['file.json']
+
+def test_archived_feed_reads_back(home):
+    source = comics_mailer.Source(comics_mailer.SOURCE_COMICLIST, '', comics_mailer.EXTRACTOR_COMICLIST, 5, '',
+        comics_mailer.DATA_FILE_FEED_CACHE, comics_mailer.DATA_FILE_FEED_META)
+    feed   = comics_mailer.parse_feed(FEED)
+    comics_mailer.archive_feed(source, FEED, comics_mailer.EntryIndex.build(source, feed.entries))
+
+    folder = comics_mailer.get_archive_folder(source)
+    names  = [n for n in os.listdir(folder) if n.endswith(comics_mailer.ARCHIVE_EXT)]
+    assert len(names) == 1
+    assert not any(n.endswith('.tmp') for n in os.listdir(folder))
+
+    archived = comics_mailer.read_archived_feed(os.path.join(folder, names[0]))
+    assert [e.title for e in archived.entries] == [e.title for e in feed.entries]
+
+def test_queued_mail_is_complete(home):
+    path = comics_mailer.queue_mail('New comics', 'Saga #1', [('reader@example.com', None)])
+    assert os.listdir(comics_mailer.DATA_FOLDER_OUTBOX) == [os.path.basename(path)]
+
+    with open(path) as f:
+        message = json.load(f)
+    assert message['recipients'] == [['reader@example.com', None]]
+    assert message['attempts'] == 0
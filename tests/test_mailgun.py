@@ -0,0 +1,106 @@
+import os
+import json
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+import pytest
+
+import comics_mailer
+
+# A fake Mailgun API answering each message with the next of the scripted (status, headers, body) responses,
+# and recording the form fields of the messages it was sent
+class FakeMailgun:
+
+    def __init__(self, http_server):
+        self.responses = []
+        self.messages  = []
+        self.url       = http_server(self.respond) + '/v3/'
+
+    def respond(self, handler):
+        body = handler.rfile.read(int(handler.headers.get('Content-Length', 0))).decode('utf-8')
+        self.messages.append(parse_qs(body))
+
+        status, headers, text = self.responses.pop(0) if self.responses else (200, {}, '{"id": "<queued>"}')
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(text)))
+        handler.end_headers()
+        handler.wfile.write(text.encode('utf-8'))
+
+@pytest.fixture
+def mailgun(http_server):
+    return FakeMailgun(http_server)
+
+@pytest.fixture
+def waits(monkeypatch):
+    waits = []
+    monkeypatch.setattr(time, 'sleep', waits.append)
+    return waits
+
+def client(url, retries=3):
+    return comics_mailer.MailgunClient('key', 'mail.tld', 'Comics Mailer <from@mail.tld>', url, retries, 0.5)
+
+def test_retries_busy_and_failing_service(mailgun, waits):
+    mailgun.responses = [(429, {'Retry-After': '7'}, 'busy'), (503, {}, 'down'), (200, {}, '{"id": "<1>"}')]
+
+    result = client(mailgun.url).send('to@tld.com', 'Subject', 'Text')
+    assert result['id'] == '<1>'
+    assert len(mailgun.messages) == 3
+
+    # The first wait honours Retry-After; the second backs off from the base delay
+    assert waits == [7, 1.0]
+
+def test_gives_up_after_the_retries(mailgun, waits):
+    mailgun.responses = [(500, {}, 'down')] * 3
+
+    with pytest.raises(comics_mailer.MailError):
+        client(mailgun.url, retries=2).send('to@tld.com', 'Subject', 'Text')
+    assert len(mailgun.messages) == 3
+
+def test_fails_straight_away_on_client_errors(mailgun, waits):
+    mailgun.responses = [(400, {}, '{"message": "bad request"}')]
+
+    with pytest.raises(comics_mailer.MailError, match='HTTP 400'):
+        client(mailgun.url).send('to@tld.com', 'Subject', 'Text')
+    assert len(mailgun.messages) == 1
+    assert waits == []
+
+def test_rejects_unqueued_message(mailgun, waits):
+    mailgun.responses = [(200, {}, '{"message": "ok"}')]
+
+    with pytest.raises(comics_mailer.MailError, match='did not queue'):
+        client(mailgun.url).send('to@tld.com', 'Subject', 'Text')
+    assert len(mailgun.messages) == 1
+
+def test_invalid_url_is_a_mail_error(waits):
+    with pytest.raises(comics_mailer.MailError):
+        client('http//mailgun.invalid/v3/').send('to@tld.com', 'Subject', 'Text')
+    assert waits == []
+
+def test_batches_split_on_size_and_duplicates(mailgun, monkeypatch):
+    monkeypatch.setattr(comics_mailer, 'MAILGUN_BATCH_SIZE', 3)
+    recipients = [('A <a@tld.com>', {'body': 'a'}), ('b@tld.com', {'body': 'b'}), ('Again <a@tld.com>', {'body': 'a2'}),
+        ('c@tld.com', {'body': 'c'}), ('d@tld.com', {'body': 'd'}), ('e@tld.com', {'body': 'e'})]
+
+    responses = client(mailgun.url).send_batch(recipients, 'Subject', '%recipient.body%')
+    assert len(responses) == 3
+
+    batches = [(m['to'], json.loads(m['recipient-variables'][0])) for m in mailgun.messages]
+    assert batches == [
+        (['A <a@tld.com>', 'b@tld.com'], {'a@tld.com': {'body': 'a'}, 'b@tld.com': {'body': 'b'}}),
+        (['Again <a@tld.com>', 'c@tld.com', 'd@tld.com'], {'a@tld.com': {'body': 'a2'}, 'c@tld.com': {'body': 'c'}, 'd@tld.com': {'body': 'd'}}),
+        (['e@tld.com'], {'e@tld.com': {'body': 'e'}}),
+    ]
+
+@pytest.mark.parametrize('dry_run', [False, True])
+def test_dry_run_leaves_the_outbox_alone(home, mailgun, monkeypatch, dry_run):
+    if dry_run:
+        monkeypatch.setattr(comics_mailer, 'DEBUG', '|'.join(['', comics_mailer.DEBUG_NOMAIL, comics_mailer.DEBUG_NOSAVE]))
+    path     = comics_mailer.queue_mail('New comics', 'Saga #1', [('reader@example.com', None)])
+    settings = SimpleNamespace(mail_client=lambda: client(mailgun.url))
+
+    assert comics_mailer.drain_outbox(settings) == (1 if dry_run else 0)
+    assert os.path.isfile(path) == dry_run
+    assert len(mailgun.messages) == (0 if dry_run else 1)
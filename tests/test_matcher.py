@@ -0,0 +1,88 @@
+import pickle
+import random
+
+import pytest
+
+import comics_mailer
+
+# Characters for the generated titles and watchlist entries: a few letters, so that entries often overlap and
+# share prefixes, with mixed case, digits and punctuation
+ALPHABET = 'abcABC #12,-'
+
+def random_text(rng, longest):
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, longest)))
+
+# The matching done before WatchlistMatcher: every watchlist entry scanned against every line
+def old_search(watchlist, line):
+    return [i for i, watched in enumerate(watchlist) if watched.lower() in line.lower()]
+
+@pytest.mark.parametrize('seed', range(20))
+def test_search_agrees_with_scan(seed):
+    rng       = random.Random(seed)
+    watchlist = [random_text(rng, 6) for _ in range(rng.randint(1, 40))]
+    matcher   = comics_mailer.WatchlistMatcher(watchlist)
+
+    for _ in range(200):
+        line = random_text(rng, 40)
+        assert matcher.search(line) == old_search(watchlist, line)
+
+def test_search_agrees_with_scan_on_release_lines():
+    watchlist = ['Batman', 'batman #1', 'Saga', 'Man', 'Spider-Man', 'amazing spider', 'Hellboy #1,']
+    lines     = ['10/21/2026,DC COMICS,Batman #12,$3.99', '10/21/2026,IMAGE COMICS,Saga #1 (Cover B Variant),$3.99',
+        '10/21/2026,MARVEL COMICS,Amazing Spider-Man #3,$4.99', '10/21/2026,DARK HORSE COMICS,Hellboy #1,$3.99',
+        '10/21/2026,DC COMICS,Batman #1,$3.99', '10/21/2026,Funko,Pop Vinyl,$9.99']
+    matcher   = comics_mailer.WatchlistMatcher(watchlist)
+
+    for line in lines:
+        assert matcher.search(line) == old_search(watchlist, line)
+
+def test_empty_entry_matches_every_line():
+    matcher = comics_mailer.WatchlistMatcher(['', 'saga'])
+    assert matcher.search('anything') == [0]
+    assert matcher.search('Saga #1') == [0, 1]
+
+def test_fuzzy_entries_without_letters_match_nothing():
+    watchlist = comics_mailer.parse_watchlist('~\n~!!!\n~0.7:\n~saga\n')
+    assert watchlist == ['~saga']
+
+    matcher = comics_mailer.WatchlistMatcher(['~', '~!!!', '~0.7:', '~saga'])
+    assert matcher.search('10/21/2026,IMAGE COMICS,Saga #1,$3.99') == [3]
+    assert matcher.search('10/21/2026,DC COMICS,Batman #1,$3.99') == []
+
+@pytest.mark.parametrize('only_once', [True, False])
+def test_different_issues_are_matched_apart(only_once):
+    comics = comics_mailer.parse_comic_records(['10/21/2026,DC COMICS,Batman 66 #5,$3.99',
+        '10/21/2026,DC COMICS,Batman #665,$3.99', '10/21/2026,DC COMICS,Batman #665,$3.99'])
+    matched = comics_mailer.match_comics(comics, ['Batman'], only_once)
+    assert [c.title for c in matched] == ['Batman 66 #5', 'Batman #665']
+
+def test_compiled_watchlist_is_reused(home):
+    path = str(home / 'watchlist.txt')
+    with open(path, 'w') as f:
+        f.write('Saga\n~0.7: hellboy bprd\n')
+
+    first  = comics_mailer.compile_watchlist(path)
+    second = comics_mailer.compile_watchlist(path)
+    assert comics_mailer.metrics.counters['watchlists_compiled'] == 1
+    assert second is not first
+
+    line = '10/21/2026,DARK HORSE COMICS,Hellboy And The BPRD 1957 #4,$3.99'
+    assert second.search(line) == first.search(line) == [1]
+    assert second.search('Saga #1') == [0]
+
+# Run if a compiled watchlist is loaded with pickle's default class lookup
+def tampered():
+    raise AssertionError('a tampered compiled watchlist ran code')
+
+class Tampered:
+
+    def __reduce__(self):
+        return tampered, ()
+
+def test_tampered_compiled_watchlist_is_not_loaded(home):
+    path = str(home / 'watchlist.pickle')
+    with open(path, 'wb') as f:
+        f.write(comics_mailer.COMPILED_WATCHLIST_HEADER)
+        pickle.dump({'matcher': Tampered()}, f)
+
+    assert comics_mailer.load_compiled_watchlist(path) is None
@@ -0,0 +1,27 @@
+import os
+import sys
+import random
+
+import feedparser
+
+import comics_mailer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from bench import make_feed
+from memory import measure_pipeline
+
+def test_peak_memory_stays_flat(home, monkeypatch):
+    # measure_pipeline() moves the parse cache into the folder it is given, which monkeypatch puts back afterwards
+    monkeypatch.setattr(comics_mailer, 'DATA_FOLDER', comics_mailer.DATA_FOLDER)
+    monkeypatch.setattr(comics_mailer, 'DATA_FILE_PARSE_CACHE', comics_mailer.DATA_FILE_PARSE_CACHE)
+    monkeypatch.setattr(comics_mailer, 'PARSE_CACHE_MAX_SIZE', 32 * 1024)
+
+    rng   = random.Random(0)
+    peaks = []
+    for entries in (10, 80):
+        feed    = feedparser.parse(make_feed(rng, entries, 100))
+        _, peak = measure_pipeline(feed, ['Hellboy #1,', 'Saga #2', 'No Such Series'], str(home))
+        peaks.append(peak)
+
+    assert peaks[1] / peaks[0] < 1.5
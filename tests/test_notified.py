@@ -0,0 +1,35 @@
+from datetime import date, timedelta
+
+import pytest
+
+import comics_mailer
+
+COMIC = comics_mailer.parse_comic_record('10/21/2026,IMAGE COMICS,Saga #1,$3.99')
+
+# Remember the comic as notified the given number of days ago
+def notify(days_ago):
+    conn = comics_mailer.open_history()
+    with conn:
+        conn.execute('INSERT INTO notified (tenant, key, notified_date) VALUES (?, ?, ?)',
+            ('', comics_mailer.get_notified_key(COMIC), (date.today() - timedelta(days=days_ago)).isoformat()))
+    conn.close()
+
+def count_notified():
+    conn = comics_mailer.open_history()
+    count, = conn.execute('SELECT COUNT(*) FROM notified').fetchone()
+    conn.close()
+    return count
+
+def test_skips_recent_notifications(home):
+    notify(3)
+    assert list(comics_mailer.filter_notified([COMIC], 30)) == []
+
+@pytest.mark.parametrize('debug', ['', comics_mailer.DEBUG_NOSAVE])
+def test_expired_notifications_are_mailed_again(home, monkeypatch, debug):
+    monkeypatch.setattr(comics_mailer, 'DEBUG', debug)
+    notify(40)
+
+    assert list(comics_mailer.filter_notified([COMIC], 30)) == [COMIC]
+
+    # Without saving, nothing is purged either
+    assert count_notified() == (1 if debug else 0)
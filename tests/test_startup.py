@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from startup import COMMANDS, HEAVY_MODULES, run_importtime
+
+@pytest.mark.parametrize('name,args', COMMANDS, ids=[name for name, _ in COMMANDS])
+def test_defers_heavy_imports(name, args):
+    _, modules = run_importtime(args)
+    assert 'comics_mailer' in modules
+    assert [m for m in HEAVY_MODULES if m in modules] == []